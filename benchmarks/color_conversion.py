@@ -0,0 +1,45 @@
+"""
+Compares scalar and batch color conversion throughput.
+
+Usage: python benchmarks/color_conversion.py [num_colors]
+"""
+
+import sys
+import random
+import timeit
+
+from pyhuelights import colorutils
+from pyhuelights.colorutils import rgb_to_xy, xy_to_rgb
+from pyhuelights.colorutils import rgb_to_xy_batch, xy_to_rgb_batch
+
+
+def report(name, func, num_colors):
+    best = min(timeit.repeat(func, number=10, repeat=5)) / 10
+    print(f"{name:>24}: {num_colors / best / 1e6:.2f} M colors/s")
+
+
+def main():
+    num_colors = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rgb = [(random.randrange(256), random.randrange(256), random.randrange(256))
+           for _ in range(num_colors)]
+    xy = [rgb_to_xy(*x) for x in rgb]
+
+    report("rgb_to_xy (scalar)", lambda: [rgb_to_xy(*x) for x in rgb],
+           num_colors)
+    report("xy_to_rgb (scalar)", lambda: [xy_to_rgb(*x) for x in xy],
+           num_colors)
+
+    if colorutils.np is None:
+        print("NumPy is not installed; batch APIs use the scalar fallback.")
+        return
+
+    rgb_array = colorutils.np.array(rgb)
+    xy_array = colorutils.np.array(xy)
+    report("rgb_to_xy_batch (numpy)", lambda: rgb_to_xy_batch(rgb_array),
+           num_colors)
+    report("xy_to_rgb_batch (numpy)", lambda: xy_to_rgb_batch(xy_array),
+           num_colors)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""
+Measures the memory retained by parsed Light models.
+
+Usage: python benchmarks/model_memory.py [num_lights]
+"""
+
+import sys
+import tracemalloc
+
+from pyhuelights.network import dict_parser
+from pyhuelights.model import Light
+
+from parse_lights import LIGHT_JSON
+
+
+def main():
+    num_lights = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    response = {str(i): LIGHT_JSON for i in range(num_lights)}
+    parser = dict_parser(Light)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    lights = parser(response)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    retained = sum(x.size_diff for x in after.compare_to(before, "filename"))
+    print(f"{len(lights)} lights: {retained / len(lights):.0f} bytes per light")
+
+
+if __name__ == "__main__":
+    main()
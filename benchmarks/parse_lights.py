@@ -0,0 +1,58 @@
+"""
+Micro-benchmark for parsing a `/lights` response into model objects.
+
+Usage: python benchmarks/parse_lights.py [num_lights]
+"""
+
+import sys
+import timeit
+
+from pyhuelights.model import Light
+from pyhuelights.network import dict_parser
+
+LIGHT_JSON = {
+    "state": {
+        "on": True,
+        "bri": 254,
+        "hue": 13248,
+        "sat": 5,
+        "effect": "none",
+        "xy": [0.3812, 0.3793],
+        "ct": 250,
+        "alert": "select",
+        "colormode": "ct",
+        "mode": "homeautomation",
+        "reachable": True
+    },
+    "name": "Light",
+    "capabilities": {
+        "control": {
+            "colorgamuttype": "C",
+            "colorgamut": [[0.6915, 0.3083], [0.17, 0.7], [0.1532, 0.0475]],
+            "ct": {
+                "min": 153,
+                "max": 500
+            }
+        },
+    },
+    "uniqueid": "00:17:88:01:04:05:09:f7-0b",
+    "swversion": "1.116.3",
+    "type": "Extended color light",
+    "modelid": "LCT015"
+}
+
+
+def main():
+    num_lights = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    response = {str(i): LIGHT_JSON for i in range(num_lights)}
+    parser = dict_parser(Light)
+
+    number = 200
+    best = min(timeit.repeat(lambda: parser(response), number=number,
+                             repeat=5))
+    per_light = best / number / num_lights * 1e6
+    print(f"{num_lights} lights: {per_light:.2f} us per light")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 from .discovery import DefaultDiscovery, StaticHostDiscovery, MDNSDiscovery
-from .discovery import NUPNPDiscovery, BaseDiscovery
+from .discovery import NUPNPDiscovery, BaseDiscovery, DiscoveryReport
+from .discovery import CachedDiscovery, DiscoveryCache, BridgeWatcher
+from .discovery import BridgeDescription
 from .core import LightsManager
+from .mirror import BridgeStateMirror
 
 __all__ = [
     'DefaultDiscovery', 'StaticHostDiscovery', 'MDNSDiscovery',
-    'NUPNPDiscovery', 'BaseDiscovery', 'LightsManager'
+    'NUPNPDiscovery', 'BaseDiscovery', 'DiscoveryReport', 'CachedDiscovery',
+    'DiscoveryCache', 'BridgeWatcher', 'BridgeDescription', 'LightsManager',
+    'BridgeStateMirror'
 ]
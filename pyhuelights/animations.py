@@ -1,6 +1,7 @@
+import math
 import time
 import asyncio
-from typing import Any, AsyncGenerator
+from typing import Any, AsyncGenerator, Dict
 
 from pyhuelights.core import Color, Light, RGB, Temperature, HueSat
 from pyhuelights.colorutils import rgb_to_xy
@@ -20,6 +21,77 @@ async def linear_transition(start, end, steps) -> AsyncGenerator[Any, None]:
     yield end
 
 
+class FrameClock:
+    """
+    Monotonic frame timer that many effects can share. Frame n is due at
+    start + n / rate; all effects waiting for the same frame are woken by a
+    single timer.
+    """
+
+    def __init__(self, rate: float):
+        if rate <= 0:
+            raise ValueError("Frame rate must be positive.")
+        self.rate = rate
+        self.interval = 1.0 / rate
+        self.started: float | None = None
+        self.dropped_frames = 0
+        self._waiters: Dict[int, asyncio.Future] = {}
+
+    def now(self) -> float:
+        loop = asyncio.get_running_loop()
+        if self.started is None:
+            self.started = loop.time()
+        return loop.time() - self.started
+
+    def current_frame(self) -> int:
+        return math.floor(self.now() * self.rate)
+
+    async def wait_for_frame(self, frame: int) -> None:
+        self.now()  # Starts the clock if needed.
+        future = self._waiters.get(frame)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._waiters[frame] = future
+            loop.call_at(self.started + frame * self.interval, self._fire,
+                         frame)
+        await asyncio.shield(future)
+
+    def _fire(self, frame: int) -> None:
+        future = self._waiters.pop(frame)
+        if not future.done():
+            future.set_result(None)
+
+    def ticker(self) -> "FrameTicker":
+        return FrameTicker(self)
+
+
+class FrameTicker:
+    """
+    One effect's view of a FrameClock. tick() waits for the next frame,
+    compensating for time spent since the last one. If that frame is already
+    overdue, it returns right away with the latest due frame and counts the
+    skipped ones as dropped.
+    """
+
+    def __init__(self, clock: FrameClock):
+        self.clock = clock
+        self.frame = clock.current_frame()
+        self.dropped_frames = 0
+
+    async def tick(self) -> int:
+        target = self.frame + 1
+        current = self.clock.current_frame()
+        if current >= target:
+            self.dropped_frames += current - target
+            self.clock.dropped_frames += current - target
+            target = current
+        else:
+            await self.clock.wait_for_frame(target)
+        self.frame = target
+        return target
+
+
 class ColorLoopEffect:
 
     def __init__(self, transition_time: int | None = None):
@@ -29,12 +101,12 @@ class ColorLoopEffect:
         if self.transition_time is not None:
             light._model.state.transition_time = self.transition_time
 
-        start_time = time.time()
+        start_time = time.monotonic()
         light._model.state.effect = "colorloop"
         yield light._model.state
 
         if self.transition_time is not None:
-            sleep_time = self.transition_time - (time.time() - start_time)
+            sleep_time = self.transition_time - (time.monotonic() - start_time)
             if sleep_time > 0:
                 await asyncio.sleep(sleep_time)
 
@@ -73,7 +145,8 @@ class SetLightStateEffect:
                 state.color_mode = 'hs'
             elif isinstance(self.color, RGB):
                 state.xy = list(
-                    rgb_to_xy(self.color.r, self.color.g, self.color.b))
+                    rgb_to_xy(self.color.r, self.color.g, self.color.b,
+                              light.gamut))
                 state.color_mode = 'xy'
 
         yield state
@@ -93,17 +166,23 @@ class SwitchOffEffect(SetLightStateEffect):
 
 class RotateEffect:
 
-    def __init__(self, colors: list[Color], transition_time: int):
+    def __init__(self,
+                 colors: list[Color],
+                 transition_time: int,
+                 clock: FrameClock | None = None):
         self.transition_time = transition_time
         self.effects = [SetLightStateEffect(True, x, 100) for x in colors]
+        # Shared by all lights this effect runs on.
+        self.clock = clock or FrameClock(10.0)
 
     async def update_state(self, light: Light) -> AsyncGenerator[Any, None]:
         len_effects = len(self.effects)
-        start_time = time.time()
+        ticker = self.clock.ticker()
+        start_time = time.monotonic()
         iteration = -1
-        while time.time() - start_time <= self.transition_time:
+        while time.monotonic() - start_time <= self.transition_time:
             iteration += 1
             effect_index = iteration % len_effects
             async for state in self.effects[effect_index].update_state(light):
                 yield state
-            await asyncio.sleep(0.1)
+            await ticker.tick()
@@ -1,19 +1,158 @@
 import math
-from typing import Tuple
+from functools import lru_cache
+from typing import Any, Dict, Tuple
 
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
 
-def rgb_to_xy(r: int, g: int, b: int) -> Tuple[float, float]:
-    """ Standard sRGB to XYZ (D65) transformation. """
+Point = Tuple[float, float]
 
-    def enhance_color(normalized):
-        if normalized > 0.04045:
-            return math.pow((normalized + 0.055) / (1.0 + 0.055), 2.4)
-        else:
-            return normalized / 12.92
+# Standard sRGB to XYZ matrix (D65), and its inverse.
+RGB_TO_XYZ = ((0.4124, 0.3576, 0.1805), (0.2126, 0.7152, 0.0722),
+              (0.0193, 0.1192, 0.9505))
+XYZ_TO_RGB = ((3.2406, -1.5372, -0.4986), (-0.9689, 1.8758, 0.0415),
+              (0.0557, -0.2040, 1.0570))
 
-    r_e = enhance_color(r / 255.0)
-    g_e = enhance_color(g / 255.0)
-    b_e = enhance_color(b / 255.0)
+
+CACHE_SIZE = 1024
+# xy inputs are rounded to this many digits, the bridge's own precision.
+XY_PRECISION = 4
+
+
+def linearize(normalized: float) -> float:
+    """ sRGB companding, from a [0, 1] channel value to linear light. """
+    if normalized > 0.04045:
+        return math.pow((normalized + 0.055) / (1.0 + 0.055), 2.4)
+    else:
+        return normalized / 12.92
+
+
+def delinearize(normalized: float) -> float:
+    """ Inverse sRGB companding. """
+    if normalized <= 0.0031308:
+        return normalized * 12.92
+    else:
+        return (1.0 + 0.055) * math.pow(normalized, (1.0 / 2.4)) - 0.055
+
+
+# Linear light value of every 8-bit channel value.
+LINEARIZE_TABLE = tuple(linearize(i / 255.0) for i in range(256))
+
+
+class Gamut(object):
+    """
+    Triangle of xy colors a light can reproduce. Edge vectors and their
+    squared lengths are computed once so that clipping is a few
+    multiplications per edge.
+    """
+
+    def __init__(self, red: Point, green: Point, blue: Point):
+        self.points = (tuple(red), tuple(green), tuple(blue))
+        self.edges = []
+        for (ax, ay), (bx, by) in zip(self.points,
+                                      self.points[1:] + self.points[:1]):
+            dx, dy = bx - ax, by - ay
+            self.edges.append((ax, ay, dx, dy, dx * dx + dy * dy))
+        # Sign of the triangle's winding, to test which side a point is on.
+        (_, _, dx1, dy1, _), (_, _, dx2, dy2, _) = self.edges[:2]
+        self.orientation = 1.0 if dx1 * dy2 - dy1 * dx2 >= 0 else -1.0
+
+    def contains(self, x: float, y: float) -> bool:
+        for ax, ay, dx, dy, _ in self.edges:
+            if (dx * (y - ay) - dy * (x - ax)) * self.orientation < 0:
+                return False
+        return True
+
+    def clip(self, x: float, y: float) -> Tuple[float, float]:
+        """ Returns xy if in gamut, else the closest point on the triangle. """
+        if self.contains(x, y):
+            return x, y
+
+        best = None
+        best_distance = math.inf
+        for ax, ay, dx, dy, length in self.edges:
+            t = ((x - ax) * dx + (y - ay) * dy) / length
+            t = max(0.0, min(t, 1.0))
+            px, py = ax + t * dx, ay + t * dy
+            distance = (x - px)**2 + (y - py)**2
+            if distance < best_distance:
+                best, best_distance = (px, py), distance
+        return best
+
+    def clip_batch(self, xy: Any) -> Any:
+        """ clip() for an N x 2 array (or a list of tuples without NumPy). """
+        if np is None:
+            return [self.clip(x, y) for x, y in xy]
+
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        x, y = xy[:, 0], xy[:, 1]
+        inside = np.ones(len(xy), dtype=bool)
+        candidates = []
+        distances = []
+        for ax, ay, dx, dy, length in self.edges:
+            inside &= (dx * (y - ay) - dy * (x - ax)) * self.orientation >= 0
+            t = np.clip(((x - ax) * dx + (y - ay) * dy) / length, 0.0, 1.0)
+            px, py = ax + t * dx, ay + t * dy
+            candidates.append(np.stack([px, py], axis=1))
+            distances.append((x - px)**2 + (y - py)**2)
+
+        closest = np.stack(candidates)[np.argmin(np.stack(distances), axis=0),
+                                       np.arange(len(xy))]
+        return np.where(inside[:, None], xy, closest)
+
+
+GAMUTS = {
+    "A": Gamut((0.704, 0.296), (0.2151, 0.7106), (0.138, 0.08)),
+    "B": Gamut((0.675, 0.322), (0.409, 0.518), (0.167, 0.04)),
+    "C": Gamut((0.6915, 0.3083), (0.17, 0.7), (0.1532, 0.0475)),
+}
+
+
+def gamut_for(control: Any) -> Gamut | None:
+    """
+    Returns the gamut described by a light's capabilities["control"], or None
+    if the light has no color gamut.
+    """
+    if not isinstance(control, dict):
+        return None
+    points = control.get("colorgamut")
+    if points and len(points) == 3:
+        return _gamut_from_points(tuple(tuple(x) for x in points))
+    return GAMUTS.get(control.get("colorgamuttype"))
+
+
+@lru_cache(maxsize=None)
+def _gamut_from_points(points: Tuple[Point, Point, Point]) -> Gamut:
+    for gamut in GAMUTS.values():
+        if gamut.points == points:
+            return gamut
+    return Gamut(*points)
+
+
+def rgb_to_xy(r: int,
+              g: int,
+              b: int,
+              gamut: Gamut | None = None) -> Tuple[float, float]:
+    """
+    Standard sRGB to XYZ (D65) transformation. If a gamut is given, the result
+    is clipped to it.
+    """
+    return _rgb_to_xy(r, g, b, gamut)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _rgb_to_xy(r: int, g: int, b: int,
+               gamut: Gamut | None) -> Tuple[float, float]:
+    if all(isinstance(c, int) and 0 <= c <= 255 for c in (r, g, b)):
+        r_e = LINEARIZE_TABLE[r]
+        g_e = LINEARIZE_TABLE[g]
+        b_e = LINEARIZE_TABLE[b]
+    else:
+        r_e = linearize(r / 255.0)
+        g_e = linearize(g / 255.0)
+        b_e = linearize(b / 255.0)
 
     # Standard sRGB to XYZ matrix (D65).
     X = r_e * 0.4124 + g_e * 0.3576 + b_e * 0.1805
@@ -22,12 +161,20 @@ def rgb_to_xy(r: int, g: int, b: int) -> Tuple[float, float]:
 
     if X + Y + Z == 0:
         return 0.0, 0.0
+    elif gamut is not None:
+        return gamut.clip(X / (X + Y + Z), Y / (X + Y + Z))
     else:
         return X / (X + Y + Z), Y / (X + Y + Z)
 
 
 def xy_to_rgb(x: float, y: float, bri: int = 255) -> Tuple[int, int, int]:
     """ XYZ to sRGB transformation. """
+    return _xy_to_rgb(round(x, XY_PRECISION), round(y, XY_PRECISION),
+                      round(bri))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _xy_to_rgb(x: float, y: float, bri: int) -> Tuple[int, int, int]:
     if bri == 0 or y == 0:
         return 0, 0, 0
 
@@ -42,15 +189,9 @@ def xy_to_rgb(x: float, y: float, bri: int = 255) -> Tuple[int, int, int]:
     b = X * 0.0557 - Y * 0.2040 + Z * 1.0570
 
     # Inverse gamma correction.
-    def reverse_enhance_color(normalized):
-        if normalized <= 0.0031308:
-            return normalized * 12.92
-        else:
-            return (1.0 + 0.055) * math.pow(normalized, (1.0 / 2.4)) - 0.055
-
-    r = reverse_enhance_color(r)
-    g = reverse_enhance_color(g)
-    b = reverse_enhance_color(b)
+    r = delinearize(r)
+    g = delinearize(g)
+    b = delinearize(b)
 
     # Scaling to handle out-of-gamut values.
     max_val = max(r, g, b)
@@ -65,3 +206,108 @@ def xy_to_rgb(x: float, y: float, bri: int = 255) -> Tuple[int, int, int]:
     b = max(0, min(1, b))
 
     return int(r * 255), int(g * 255), int(b * 255)
+
+
+def temperature_to_xy(kelvin: float) -> Tuple[float, float]:
+    """
+    Approximates the xy of a black body at the given temperature (1667K to
+    25000K), using Kang et al. (2002).
+    """
+    t = float(kelvin)
+    if t <= 4000:
+        x = (-0.2661239e9 / t**3 - 0.2343589e6 / t**2 + 0.8776956e3 / t +
+             0.179910)
+    else:
+        x = (-3.0258469e9 / t**3 + 2.1070379e6 / t**2 + 0.2226347e3 / t +
+             0.240390)
+
+    if t <= 2222:
+        y = -1.1063814 * x**3 - 1.34811020 * x**2 + 2.18555832 * x - 0.20219683
+    elif t <= 4000:
+        y = -0.9549476 * x**3 - 1.37418593 * x**2 + 2.09137015 * x - 0.16748867
+    else:
+        y = 3.0817580 * x**3 - 5.87338670 * x**2 + 3.75112997 * x - 0.37001483
+    return x, y
+
+
+def cache_stats() -> Dict[str, Any]:
+    """ Returns hit/miss statistics of the conversion caches. """
+    return {
+        "rgb_to_xy": _rgb_to_xy.cache_info(),
+        "xy_to_rgb": _xy_to_rgb.cache_info(),
+    }
+
+
+def clear_caches() -> None:
+    _rgb_to_xy.cache_clear()
+    _xy_to_rgb.cache_clear()
+
+
+def rgb_to_xy_batch(rgb: Any, gamut: Gamut | None = None) -> Any:
+    """
+    Converts many colors at once. Takes an N x 3 array of 8-bit RGB values
+    and returns an N x 2 array of xy, clipped to gamut if given. Integer
+    values outside 0..255 raise ValueError. Without NumPy, takes and returns
+    lists of tuples.
+    """
+    if np is None:
+        return [rgb_to_xy(r, g, b, gamut) for r, g, b in rgb]
+
+    rgb = np.asarray(rgb).reshape(-1, 3)
+    if np.issubdtype(rgb.dtype, np.integer):
+        if not np.all((rgb >= 0) & (rgb <= 255)):
+            raise ValueError("RGB components must be between 0 and 255")
+        linear = np.asarray(LINEARIZE_TABLE)[rgb]
+    else:
+        normalized = rgb.astype(np.float64) / 255.0
+        linear = np.where(normalized > 0.04045,
+                          ((normalized + 0.055) / (1.0 + 0.055))**2.4,
+                          normalized / 12.92)
+    xyz = linear @ np.array(RGB_TO_XYZ).T
+    total = xyz.sum(axis=1, keepdims=True)
+    safe_total = np.where(total == 0, 1.0, total)
+    xy = np.where(total == 0, 0.0, xyz[:, :2] / safe_total)
+    if gamut is not None:
+        xy = np.where(total == 0, 0.0, gamut.clip_batch(xy))
+    return xy
+
+
+def xy_to_rgb_batch(xy: Any, bri: Any = 255) -> Any:
+    """
+    Converts many colors at once. Takes an N x 2 array of xy and a scalar or
+    N-length brightness, and returns an N x 3 array of 8-bit RGB values.
+    Inputs are rounded like xy_to_rgb's. Without NumPy, takes and returns
+    lists of tuples.
+    """
+    if np is None:
+        if isinstance(bri, (int, float)):
+            bri = [bri] * len(xy)
+        return [xy_to_rgb(x, y, b) for (x, y), b in zip(xy, bri)]
+
+    # Quantized the same way as xy_to_rgb, so that both agree.
+    xy = np.round(np.asarray(xy, dtype=np.float64).reshape(-1, 2),
+                  XY_PRECISION)
+    bri = np.round(
+        np.broadcast_to(np.asarray(bri, dtype=np.float64), (len(xy), )))
+    x, y = xy[:, 0], xy[:, 1]
+    black = (bri == 0) | (y == 0)
+    safe_y = np.where(black, 1.0, y)
+
+    # XYZ from xyY coordinates.
+    Y = bri / 255.0
+    X = (Y / safe_y) * x
+    Z = (Y / safe_y) * (1.0 - x - y)
+    rgb = np.stack([X, Y, Z], axis=1) @ np.array(XYZ_TO_RGB).T
+
+    # Inverse gamma correction.
+    rgb = np.where(rgb <= 0.0031308, rgb * 12.92,
+                   (1.0 + 0.055) * np.abs(rgb)**(1.0 / 2.4) - 0.055)
+
+    # Scaling to handle out-of-gamut values, then clipping.
+    max_val = rgb.max(axis=1, keepdims=True)
+    rgb = np.where(max_val > 1.0, rgb / np.where(max_val > 1.0, max_val, 1.0),
+                   rgb)
+    rgb = np.clip(rgb, 0.0, 1.0)
+    rgb[black] = 0.0
+
+    return (rgb * 255).astype(np.int64)
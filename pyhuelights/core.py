@@ -1,10 +1,20 @@
 from typing import List, Dict, Generator, Tuple, Any, AsyncGenerator, Type
+from typing import Awaitable, Iterable
 from dataclasses import dataclass
+import asyncio
 import colorsys
+import json
+import time
+
+import httpx
 
 from .model import validate_xy, Light as LightRaw, Group, update_from_object
-from .network import BaseResourceManager, dict_parser
-from .colorutils import rgb_to_xy, xy_to_rgb
+from .model import patch_from_object
+from .model import EMPTY
+from .network import BaseResourceManager, dict_parser, RESYNC_EVENT_TYPE
+from .network import apply_update_response, construct_body
+from .colorutils import rgb_to_xy, xy_to_rgb, gamut_for, Gamut
+from .exceptions import RequestFailed
 
 
 @dataclass(frozen=True)
@@ -66,8 +76,37 @@ class LightCapabilities:
 class Light:
     """ High-level abstraction over a Light model. """
 
-    def __init__(self, light_model: LightRaw):
-        self._model = light_model
+    def __init__(self, light_model: LightRaw | None):
+        self._light_model = light_model
+        self._raw: Tuple[str, Dict[str, Any]] | None = None
+
+    @classmethod
+    def from_json(cls, light_id: str, data: Dict[str, Any]) -> "Light":
+        """
+        Creates a light whose model is only parsed when first used; its state
+        and capabilities are parsed separately, when first touched.
+        """
+        light = cls(None)
+        light._raw = (light_id, data)
+        return light
+
+    @property
+    def _model(self) -> LightRaw:
+        if self._light_model is None:
+            light_id, data = self._raw
+            self._light_model = LightRaw()
+            update_from_object(self._light_model, light_id, data, lazy=True)
+        return self._light_model
+
+    @_model.setter
+    def _model(self, value: LightRaw) -> None:
+        self._light_model = value
+        self._raw = None
+
+    @property
+    def raw_json(self) -> Dict[str, Any] | None:
+        """ The JSON this light was created from by from_json(), if any. """
+        return self._raw[1] if self._raw is not None else None
 
     @property
     def id(self) -> str:
@@ -101,6 +140,11 @@ class Light:
                                  streaming=self._model.capabilities.streaming,
                                  supported_color_models=models)
 
+    @property
+    def gamut(self) -> Gamut | None:
+        """ The xy triangle this light can reproduce, if it supports xy. """
+        return gamut_for(self._model.capabilities.control)
+
     @property
     def color(self) -> Color:
         state = self._model.state
@@ -125,11 +169,119 @@ class Light:
         self._model.state.brightness = value
 
 
+def clip_v2_to_light_state(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Translates a CLIP v2 event resource into the v1 light state keys that
+    LightState parses. Keys absent in the event are absent in the result.
+    """
+    state: Dict[str, Any] = {}
+    if data.get("type") == "zigbee_connectivity" and "status" in data:
+        state["reachable"] = data["status"] == "connected"
+    if "on" in data:
+        state["on"] = data["on"]["on"]
+    if "dimming" in data:
+        brightness = round(data["dimming"]["brightness"] * 254 / 100.0)
+        state["bri"] = max(1, min(brightness, 254))
+    if "color" in data and "xy" in data["color"]:
+        state["xy"] = [data["color"]["xy"]["x"], data["color"]["xy"]["y"]]
+        state["colormode"] = "xy"
+    color_temperature = data.get("color_temperature", {})
+    if (color_temperature.get("mirek_valid", True)
+            and color_temperature.get("mirek") is not None):
+        state["ct"] = color_temperature["mirek"]
+        state["colormode"] = "ct"
+    return state
+
+
+def plan_group_commands(
+    bodies: Dict[str, Dict[str, Any]], groups: Dict[str, Group]
+) -> Tuple[List[Tuple[str, Dict[str, Any]]], List[str]]:
+    """
+    Given the body each light (by id) is about to be sent, finds groups whose
+    lights all get the same body so that one group action can replace their
+    individual writes. Larger groups are preferred.
+
+    Returns ([(group_id, body)], [light ids still to be written one by one]).
+    """
+    by_body: Dict[str, List[str]] = {}
+    for light_id, body in bodies.items():
+        by_body.setdefault(json.dumps(body, sort_keys=True),
+                           []).append(light_id)
+
+    candidates = sorted(
+        ((group_id, frozenset(group.lights))
+         for group_id, group in groups.items()
+         if group.lights is not EMPTY and len(group.lights) > 1),
+        key=lambda x: -len(x[1]))
+
+    group_commands = []
+    remaining = []
+    for light_ids in by_body.values():
+        pending = set(light_ids)
+        for group_id, members in candidates:
+            if len(pending) < 2:
+                break
+            if members <= pending:
+                group_commands.append((group_id, bodies[light_ids[0]]))
+                pending -= members
+        remaining.extend(x for x in light_ids if x in pending)
+    return group_commands, remaining
+
+
+async def gather_tasks(coros: Iterable[Awaitable[Any]]) -> List[Any]:
+    """
+    Runs coros as tasks and returns their results in order. If one of them
+    fails, or the caller is cancelled, the remaining tasks are cancelled and
+    awaited before the exception propagates, so that none outlive the call.
+    """
+    tasks = [asyncio.ensure_future(x) for x in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@dataclass(frozen=True)
+class LightEffectResult:
+    """ Outcome of running an effect on a single light. """
+    light: Light
+    latency: float
+    error: Exception | None = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+@dataclass(frozen=True)
+class EffectRunSummary:
+    """ Per-light results of LightsManager.run_effect(...). """
+    results: List[LightEffectResult]
+
+    @property
+    def succeeded(self) -> List[LightEffectResult]:
+        return [x for x in self.results if x.succeeded]
+
+    @property
+    def failed(self) -> List[LightEffectResult]:
+        return [x for x in self.results if not x.succeeded]
+
+
 class LightsManager(BaseResourceManager):
 
-    async def get_all_lights(self) -> Dict[str, Light]:
-        """ Retrieves all lights from the bridge, and returns a dict."""
+    async def get_all_lights(self, lazy: bool = False) -> Dict[str, Light]:
+        """
+        Retrieves all lights from the bridge, and returns a dict.
+
+        With lazy=True, each light is only parsed when first used (and its
+        nested state and capabilities when first touched), which makes
+        listing large bridges cheap.
+        """
         obj = await self.make_request(relative_url="/lights", method="get")
+        if lazy:
+            return {k: Light.from_json(k, v) for k, v in obj.items()}
         raw_lights = self.parse_response(obj, parser=dict_parser(LightRaw))
         return {k: Light(v) for k, v in raw_lights.items()}
 
@@ -138,29 +290,283 @@ class LightsManager(BaseResourceManager):
         obj = await self.make_request(relative_url='/groups', method='get')
         return self.parse_response(obj, parser=dict_parser(Group))
 
-    async def run_effect(self, light: Light | List[Light],
-                         effect: Any) -> None:
+    async def set_streaming(self, group_id: str, active: bool) -> Any:
+        """ Starts or stops entertainment streaming for the given group. """
+        return await self.make_request(relative_url='/groups/' + group_id,
+                                       method='put',
+                                       body={"stream": {
+                                           "active": active
+                                       }})
+
+    async def run_effect(self,
+                         light: Light | List[Light],
+                         effect: Any,
+                         concurrent: bool = False,
+                         max_concurrency: int | None = None,
+                         groups: Dict[str, Group] | None = None
+                         ) -> EffectRunSummary:
         """
         Runs the change represented by effect on the given light instance(s).
+
+        By default lights are processed one after another and the first failed
+        request is raised. With concurrent=True, every light runs as its own
+        task (at most max_concurrency at a time) and request failures are
+        collected in the returned summary instead of being raised.
+
+        With groups (as returned by get_all_groups()), the lights' effects are
+        stepped in lockstep, and whenever all lights of a group are about to
+        receive the same state, a single group action is sent instead. The
+        requests of a step are sent one after another, or with concurrent=True
+        in parallel (at most max_concurrency at a time); a failed group action
+        counts as failed for every light it covered.
         """
         lights = [light] if isinstance(light, (Light, LightRaw)) else light
-
-        for l in lights:
-            if isinstance(l, LightRaw):
-                l = Light(l)
-
+        lights = [Light(l) if isinstance(l, LightRaw) else l for l in lights]
+
+        if groups is not None:
+            return await self._run_grouped_effect(lights, effect, groups,
+                                                  concurrent, max_concurrency)
+
+        if not concurrent:
+            return EffectRunSummary(results=[
+                await self._run_light_effect(l, effect, raise_errors=True)
+                for l in lights
+            ])
+
+        semaphore = asyncio.Semaphore(max_concurrency or len(lights) or 1)
+
+        async def run_limited(l: Light) -> LightEffectResult:
+            async with semaphore:
+                return await self._run_light_effect(l, effect,
+                                                    raise_errors=False)
+
+        results = await gather_tasks(run_limited(l) for l in lights)
+        return EffectRunSummary(results=results)
+
+    async def _run_grouped_effect(self, lights: List[Light], effect: Any,
+                                  groups: Dict[str, Group], concurrent: bool,
+                                  max_concurrency: int | None
+                                  ) -> EffectRunSummary:
+        started = time.monotonic()
+        by_id = {l._model.id: l for l in lights}
+        latencies: Dict[str, float] = {}
+        errors: Dict[str, Exception] = {}
+        semaphore = asyncio.Semaphore(max_concurrency or len(lights) or 1)
+        generators = {}
+        for light_id, l in by_id.items():
             l._model.reset()
-            async for state in effect.update_state(l):
+            generators[light_id] = effect.update_state(l)
+
+        async def send(relative_url: str, body: Dict[str, Any],
+                       light_ids: List[str]) -> None:
+            async with semaphore:
+                try:
+                    response = await self.make_update_request(
+                        relative_url, body)
+                except (RequestFailed, httpx.RequestError) as exc:
+                    if not concurrent:
+                        raise
+                    for light_id in light_ids:
+                        errors[light_id] = exc
+                    return
+            for light_id in light_ids:
+                apply_update_response(step[light_id], response, relative_url)
+
+        try:
+            while generators:
+                states = await asyncio.gather(*(anext(x, None)
+                                                for x in generators.values()))
+                step = dict(zip(generators, states))
+                for light_id, state in step.items():
+                    if state is None:
+                        del generators[light_id]
+                        latencies[light_id] = time.monotonic() - started
+
+                # Groups are planned on each light's full target, so that a
+                # light already in that state still matches its group; the
+                # diff only decides whether anything needs sending.
+                bodies = {}
+                needed = set()
+                for light_id, state in step.items():
+                    if state is None:
+                        continue
+                    bodies[light_id] = construct_body(state)
+                    if (not self.skip_unchanged
+                            or construct_body(state, changed_only=True)):
+                        needed.add(light_id)
+
+                group_commands, remaining = plan_group_commands(
+                    bodies, groups)
+                requests = []
+                for group_id, body in group_commands:
+                    members = [
+                        x for x in groups[group_id].lights if x in bodies
+                    ]
+                    if needed.intersection(members):
+                        requests.append(
+                            ("/groups/" + group_id + "/action", body, members))
+                requests.extend((step[light_id].relative_url(),
+                                 bodies[light_id], [light_id])
+                                for light_id in remaining
+                                if light_id in needed)
+
+                sent = {x for _, _, light_ids in requests for x in light_ids}
+                for light_id in bodies.keys() - sent:
+                    self.suppressed_writes += 1
+                    step[light_id].commit()
+                if concurrent:
+                    await gather_tasks(send(*x) for x in requests)
+                else:
+                    for request in requests:
+                        await send(*request)
+
+                for light_id in bodies:
+                    if light_id in errors and light_id in generators:
+                        # A failed light stops taking part in the effect.
+                        await generators.pop(light_id).aclose()
+                        latencies[light_id] = time.monotonic() - started
+        finally:
+            for generator in generators.values():
+                await generator.aclose()
+
+        return EffectRunSummary(results=[
+            LightEffectResult(light=l,
+                              latency=latencies[l._model.id],
+                              error=errors.get(l._model.id)) for l in lights
+        ])
+
+    async def _run_light_effect(self, light: Light, effect: Any,
+                                raise_errors: bool) -> LightEffectResult:
+        started = time.monotonic()
+        error = None
+        light._model.reset()
+        try:
+            async for state in effect.update_state(light):
                 await self.make_resource_update_request(state)
+        except (RequestFailed, httpx.RequestError) as exc:
+            if raise_errors:
+                raise
+            error = exc
+
+        return LightEffectResult(light=light,
+                                 latency=time.monotonic() - started,
+                                 error=error)
+
+    async def iter_events(
+            self,
+            lights: Dict[str, Light] | None = None,
+            reconnect: bool = False,
+            groups: Dict[str, Group] | None = None
+    ) -> AsyncGenerator[Light | Group, None]:
+        """
+        Iterates over real-time events from the bridge.
+
+        Without `lights`, the latest state of every light mentioned in an
+        event is fetched from the bridge. With `lights` (as returned by
+        get_all_lights()), the event payload is applied to those objects in
+        place and no request is made; lights missing from the dict are fetched
+        once and added to it.
+
+        With `groups` (as returned by get_all_groups()), group events are
+        applied to that dict too and the changed groups are yielded: on/off
+        changes are patched in place, other changes (name, members, new
+        groups) fetch the group again, and deleted groups are removed.
+
+        With reconnect=True the stream survives bridge restarts; after each
+        reconnection all lights (and groups) are refreshed and yielded.
+        """
+        async for change in super().iter_events(reconnect=reconnect):
+            if change.get("type") == RESYNC_EVENT_TYPE:
+                async for light in self._resync_lights(lights):
+                    yield light
+                if groups is not None:
+                    async for group in self._resync_groups(groups):
+                        yield group
+                continue
 
-    async def iter_events(self) -> AsyncGenerator[Light, None]:
-        """ Iterates over real-time events from the bridge. """
-        async for change in super().iter_events():
             for data in change["data"]:
-                light_id = data.get("id_v1")
-                if not light_id or not light_id.startswith("/lights"):
+                resource_id = data.get("id_v1") or ""
+                if resource_id.startswith("/groups/"):
+                    if groups is not None:
+                        group = await self._apply_group_event(
+                            groups, change.get("type"),
+                            resource_id.replace("/groups/", ""), data)
+                        if group is not None:
+                            yield group
                     continue
-
-                raw_light = await self.get_resource(
-                    resource_id=light_id.replace("/lights/", ""), typ=LightRaw)
-                yield Light(raw_light)
+                if not resource_id.startswith("/lights"):
+                    continue
+                light_id = resource_id.replace("/lights/", "")
+
+                if lights is None:
+                    raw_light = await self.get_resource(resource_id=light_id,
+                                                        typ=LightRaw)
+                    yield Light(raw_light)
+                elif change.get("type") == "delete":
+                    lights.pop(light_id, None)
+                elif light_id not in lights:
+                    raw_light = await self.get_resource(resource_id=light_id,
+                                                        typ=LightRaw)
+                    lights[light_id] = Light(raw_light)
+                    yield lights[light_id]
+                else:
+                    model = lights[light_id]._model
+                    state = clip_v2_to_light_state(data)
+                    name = data.get("metadata", {}).get("name")
+                    if state:
+                        patch_from_object(model.state, state)
+                    if name is not None and name != model.name:
+                        patch_from_object(model, {"name": name})
+                    if state or name is not None:
+                        yield lights[light_id]
+
+    async def _apply_group_event(self, groups: Dict[str, Group],
+                                 event_type: str | None, group_id: str,
+                                 data: Dict[str, Any]) -> Group | None:
+        if event_type == "delete":
+            groups.pop(group_id, None)
+            return None
+        if group_id not in groups:
+            # Only new rooms and zones are picked up; ids the caller did not
+            # load (e.g. /groups/0, the all-lights group) are ignored.
+            if event_type != "add" or data.get("type") not in ("room",
+                                                                 "zone"):
+                return None
+        elif data.get("type") == "grouped_light":
+            if "on" not in data:
+                return None
+            patch_from_object(groups[group_id].state,
+                              {"on": data["on"]["on"]})
+            return groups[group_id]
+
+        groups[group_id] = await self.get_resource(resource_id=group_id,
+                                                   typ=Group)
+        return groups[group_id]
+
+    async def _resync_groups(
+            self, groups: Dict[str, Group]) -> AsyncGenerator[Group, None]:
+        fresh = await self.get_all_groups()
+        for group_id in set(groups) - set(fresh):
+            del groups[group_id]
+        groups.update(fresh)
+        for group in groups.values():
+            yield group
+
+    async def _resync_lights(
+            self, lights: Dict[str, Light] | None
+    ) -> AsyncGenerator[Light, None]:
+        fresh = await self.get_all_lights()
+        if lights is None:
+            for light in fresh.values():
+                yield light
+            return
+
+        for light_id in set(lights) - set(fresh):
+            del lights[light_id]
+        for light_id, light in fresh.items():
+            if light_id in lights:
+                # Keep the existing wrapper so references to it stay valid.
+                lights[light_id]._model = light._model
+            else:
+                lights[light_id] = light
+            yield lights[light_id]
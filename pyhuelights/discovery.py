@@ -3,8 +3,14 @@ This module contains all the discovery method used to discover the Philips
 Hue bridge on the current network.
 """
 
+import os
+import json
+import time
 import socket
 import asyncio
+import xml.etree.ElementTree as ElementTree
+from dataclasses import dataclass, field
+from typing import Dict
 
 import httpx
 from zeroconf import ServiceBrowser, ServiceListener
@@ -14,19 +20,58 @@ from .exceptions import DiscoveryFailed
 
 
 class MDNSListener(ServiceListener):
+    """
+    Calls `callback` with the service info of every added or updated
+    service, and `remove_callback` (if any) with the name of every removed
+    one. Both are called from zeroconf's thread.
+    """
 
-    def __init__(self, callback):
+    def __init__(self, callback, remove_callback=None):
         self.callback = callback
+        self.remove_callback = remove_callback
 
     def add_service(self, zc, typ, name) -> None:
         info = zc.get_service_info(typ, name)
         self.callback(info)
 
     def remove_service(self, zc, type_, name) -> None:
-        pass
+        if self.remove_callback is not None:
+            self.remove_callback(name)
 
     def update_service(self, zc, type_, name) -> None:
-        pass
+        info = zc.get_service_info(type_, name)
+        self.callback(info)
+
+
+UPNP_NAMESPACE = "{urn:schemas-upnp-org:device-1-0}"
+# Bridge models whose firmware serves the CLIP v2 API and entertainment
+# streaming; the original round bridge (BSB001) does neither.
+CLIP_V2_MODELS = {"BSB002", "BSB003"}
+
+
+@dataclass(frozen=True)
+class BridgeDescription:
+    """ Identity of a bridge, as read from its description.xml. """
+    serial_number: str | None = None
+    manufacturer: str | None = None
+    model_name: str | None = None
+    model_number: str | None = None
+
+    @property
+    def supports_clip_v2(self):
+        return self.model_number in CLIP_V2_MODELS
+
+    @property
+    def supports_entertainment(self):
+        return self.model_number in CLIP_V2_MODELS
+
+
+DESCRIPTION_TAGS = {
+    UPNP_NAMESPACE + "serialNumber": "serial_number",
+    UPNP_NAMESPACE + "manufacturer": "manufacturer",
+    UPNP_NAMESPACE + "modelName": "model_name",
+    UPNP_NAMESPACE + "modelNumber": "model_number",
+}
 
 
 class UnauthenticatedHueRawConnectionInfo(object):
@@ -34,21 +79,69 @@ class UnauthenticatedHueRawConnectionInfo(object):
 
     def __init__(self, host):
         self.host = host
-
-    async def validate(self):
+        self.description = None
+
+    @property
+    def bridge_id(self):
+        if self.description is None or not self.description.serial_number:
+            return None
+        return self.description.serial_number.lower()
+
+    async def validate(self, timeout=5.0, client=None):
+        """
+        Fetches and parses the bridge's description.xml, keeping the result
+        in `description`. Returns whether host is a Hue bridge. Pass `client`
+        to reuse a connection pool across many validations.
+        """
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.get("http://{}/description.xml".format(
-                    self.host),
-                                        timeout=5.0)
-                if resp.status_code != 200:
-                    return False
-                return "Philips" in resp.text
-        except (httpx.RequestError, httpx.TimeoutException):
+            if client is not None:
+                description = await self.fetch_description(client, timeout)
+            else:
+                async with httpx.AsyncClient() as client:
+                    description = await self.fetch_description(
+                        client, timeout)
+        except (httpx.RequestError, httpx.TimeoutException,
+                ElementTree.ParseError):
             return False
 
+        if description is None or not any(
+                "Philips" in (x or "")
+                for x in (description.manufacturer, description.model_name)):
+            return False
+        self.description = description
+        return True
+
+    async def fetch_description(self, client, timeout):
+        """
+        Parses description.xml while it streams in, and stops reading once the
+        device details are complete (the rest lists icons and services).
+        """
+        url = "http://{}/description.xml".format(self.host)
+        async with client.stream("GET", url, timeout=timeout) as resp:
+            if resp.status_code != 200:
+                return None
+
+            parser = ElementTree.XMLPullParser(events=("end", ))
+            values = {}
+            async for chunk in resp.aiter_bytes():
+                parser.feed(chunk)
+                for _, element in parser.read_events():
+                    if element.tag in DESCRIPTION_TAGS:
+                        values[DESCRIPTION_TAGS[element.tag]] = element.text
+                    if len(values) == len(DESCRIPTION_TAGS):
+                        return BridgeDescription(**values)
+            parser.close()
+            return BridgeDescription(**values)
+
 
 class BaseDiscovery(object):
+    """
+    Base class of the discovery methods. If `client` is given, all requests
+    (including validation) go through it instead of a client per request.
+    """
+
+    def __init__(self, client=None):
+        self.client = client
 
     async def discover(self):
         host = await self.discover_host()
@@ -58,7 +151,7 @@ class BaseDiscovery(object):
     async def validate_host(self, host):
         connection_info = UnauthenticatedHueRawConnectionInfo(host)
 
-        if not await connection_info.validate():
+        if not await connection_info.validate(client=self.client):
             raise DiscoveryFailed
 
         return connection_info
@@ -66,6 +159,13 @@ class BaseDiscovery(object):
     async def discover_host(self):
         raise NotImplementedError
 
+    async def discover_hosts(self, timeout=None):
+        """
+        Yields every host found within `timeout` seconds, unvalidated. By
+        default, only the host found by discover_host().
+        """
+        yield await self.discover_host()
+
     def discovery_finished(self, connection_info):
         return connection_info
 
@@ -78,21 +178,33 @@ class NUPNPDiscovery(BaseDiscovery):
 
     NUPNP_URL = "https://discovery.meethue.com"
 
-    async def discover_host(self):
+    async def fetch_bridges(self):
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(self.NUPNP_URL, timeout=10.0)
-                obj = resp.json()
+            if self.client is not None:
+                resp = await self.client.get(self.NUPNP_URL, timeout=10.0)
+            else:
+                async with httpx.AsyncClient() as client:
+                    resp = await client.get(self.NUPNP_URL, timeout=10.0)
+            obj = resp.json()
         except (httpx.RequestError, ValueError):
             raise DiscoveryFailed
 
         if not isinstance(obj, list) or len(obj) == 0:
             raise DiscoveryFailed
+        return obj
+
+    async def discover_host(self):
+        obj = await self.fetch_bridges()
         try:
             return obj[0]['internalipaddress']
         except KeyError:
             raise DiscoveryFailed
 
+    async def discover_hosts(self, timeout=None):
+        for bridge in await self.fetch_bridges():
+            if isinstance(bridge, dict) and 'internalipaddress' in bridge:
+                yield bridge['internalipaddress']
+
 
 class StaticHostDiscovery(BaseDiscovery):
     """
@@ -108,46 +220,369 @@ class MDNSDiscovery(BaseDiscovery):
     MDNS based discovery of the Hue bridge.
     """
 
+    TIMEOUT = 5.0
+
     async def discover_host(self):
-        devices = []
-        event = asyncio.Event()
+        hosts = self.discover_hosts()
+        try:
+            async for host in hosts:
+                return host
+        finally:
+            await hosts.aclose()
+
+        raise DiscoveryFailed
+
+    async def discover_hosts(self, timeout=None):
+        devices = asyncio.Queue()
         loop = asyncio.get_running_loop()
 
         def on_device_found(x):
             if x:
-                devices.append(x)
-                loop.call_soon_threadsafe(event.set)
+                loop.call_soon_threadsafe(devices.put_nowait, x)
 
         aio_zc = AsyncZeroconf()
         listener = MDNSListener(on_device_found)
         browser = ServiceBrowser(aio_zc.zeroconf, "_hue._tcp.local.", listener)
+        deadline = loop.time() + (timeout or self.TIMEOUT)
 
         try:
-            await asyncio.wait_for(event.wait(), timeout=5.0)
-        except asyncio.TimeoutError:
-            pass
+            while True:
+                try:
+                    device = await asyncio.wait_for(devices.get(),
+                                                    deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+                if device.addresses:
+                    yield socket.inet_ntoa(device.addresses[0])
         finally:
             browser.cancel()
             await aio_zc.async_close()
 
-        if not devices:
-            raise DiscoveryFailed
 
-        return socket.inet_ntoa(devices[0].addresses[0])
+@dataclass
+class DiscoveryReport:
+    """
+    How a DefaultDiscovery run went: the winning method's class name, and per
+    method the seconds it ran for and its outcome ("won", "succeeded",
+    "failed" or "cancelled").
+    """
+    winner: str | None = None
+    durations: Dict[str, float] = field(default_factory=dict)
+    outcomes: Dict[str, str] = field(default_factory=dict)
 
 
 class DefaultDiscovery(object):
     """
     Discovery methods that tries all other discovery methods sequentially.
+
+    With race=True, all methods run concurrently instead; the first one to
+    find a validated bridge wins and the others are cancelled. The report of
+    the last run is kept in `last_report`.
     """
     METHODS = [MDNSDiscovery, StaticHostDiscovery, NUPNPDiscovery]
 
+    def __init__(self, race=False):
+        self.race = race
+        self.last_report = None
+
     async def discover(self):
+        # One client serves the requests of all methods.
+        async with httpx.AsyncClient() as client:
+            if self.race:
+                return await self._discover_racing(client)
+            return await self._discover_sequential(client)
+
+    async def _discover_sequential(self, client):
+        report = DiscoveryReport()
+        self.last_report = report
+        loop = asyncio.get_running_loop()
         for cls in self.METHODS:
-            method = cls()
+            method = cls(client)
+            started = loop.time()
             try:
-                return await method.discover()
+                result = await method.discover()
             except DiscoveryFailed:
-                pass
+                report.outcomes[cls.__name__] = "failed"
+                continue
+            finally:
+                report.durations[cls.__name__] = loop.time() - started
+
+            report.winner = cls.__name__
+            report.outcomes[cls.__name__] = "won"
+            return result
 
         raise DiscoveryFailed
+
+    async def discover_all(self, window=5.0):
+        """
+        Yields every bridge that the discovery methods find within `window`
+        seconds, as soon as it is validated. Hosts are validated
+        concurrently, and bridges are deduplicated by their bridge id.
+        """
+        found = asyncio.Queue()
+        seen_hosts = set()
+        validations = []
+        client = httpx.AsyncClient()
+
+        async def validate(host):
+            connection_info = UnauthenticatedHueRawConnectionInfo(host)
+            if await connection_info.validate(client=client):
+                await found.put(connection_info)
+
+        async def collect(cls):
+            hosts = cls(client).discover_hosts(window)
+            try:
+                async for host in hosts:
+                    if host not in seen_hosts:
+                        seen_hosts.add(host)
+                        validations.append(
+                            asyncio.create_task(validate(host)))
+            except DiscoveryFailed:
+                pass
+            finally:
+                await hosts.aclose()
+
+        async def run():
+            collectors = [
+                asyncio.create_task(collect(cls)) for cls in self.METHODS
+            ]
+            try:
+                await asyncio.wait(collectors, timeout=window)
+            finally:
+                for task in collectors:
+                    task.cancel()
+                await asyncio.gather(*collectors, return_exceptions=True)
+            await asyncio.gather(*validations, return_exceptions=True)
+            await found.put(None)
+
+        runner = asyncio.create_task(run())
+        seen_bridges = set()
+        try:
+            while True:
+                connection_info = await found.get()
+                if connection_info is None:
+                    break
+                key = connection_info.bridge_id or connection_info.host
+                if key not in seen_bridges:
+                    seen_bridges.add(key)
+                    yield connection_info
+        finally:
+            tasks = [runner] + validations
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await client.aclose()
+
+    async def _discover_racing(self, client):
+        report = DiscoveryReport()
+        self.last_report = report
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        names = {
+            asyncio.create_task(cls(client).discover()): cls.__name__
+            for cls in self.METHODS
+        }
+        order = list(names)
+        pending = set(names)
+        result = None
+
+        try:
+            while pending and report.winner is None:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                # Methods finishing together are ranked by METHODS order.
+                for task in sorted(done, key=order.index):
+                    name = names[task]
+                    report.durations[name] = loop.time() - started
+                    if isinstance(task.exception(), DiscoveryFailed):
+                        report.outcomes[name] = "failed"
+                    elif task.exception() is not None:
+                        raise task.exception()
+                    elif report.winner is None:
+                        report.winner = name
+                        report.outcomes[name] = "won"
+                        result = task.result()
+                    else:
+                        report.outcomes[name] = "succeeded"
+        finally:
+            # Waiting for the cancelled tasks lets them clean up, e.g. close
+            # their AsyncZeroconf instance.
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in pending:
+                report.durations[names[task]] = loop.time() - started
+                report.outcomes[names[task]] = "cancelled"
+
+        if report.winner is None:
+            raise DiscoveryFailed
+        return result
+
+
+class DiscoveryCache(object):
+    """
+    File-backed record of discovered bridges: per bridge id, the last known
+    host and when it was last validated.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+        self.entries = entries if isinstance(entries, dict) else {}
+
+    def save(self):
+        # Written to a temporary file first, so a crash can't truncate it.
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.path)
+
+    def remember(self, connection_info):
+        key = connection_info.bridge_id or connection_info.host
+        self.entries[key] = {
+            "host": connection_info.host,
+            "validated_at": time.time()
+        }
+        self.save()
+
+    def forget(self, key):
+        if self.entries.pop(key, None) is not None:
+            self.save()
+
+    def recent(self, max_age):
+        """ Returns (key, host) validated within max_age, newest first. """
+        now = time.time()
+        entries = sorted(self.entries.items(),
+                         key=lambda x: -x[1].get("validated_at", 0))
+        return [(key, entry["host"]) for key, entry in entries
+                if "host" in entry
+                and now - entry.get("validated_at", 0) <= max_age]
+
+
+class CachedDiscovery(object):
+    """
+    Tries the bridges remembered in a DiscoveryCache first, with a short
+    timeout, and only runs `fallback` (DefaultDiscovery by default) if none of
+    them still answers. Whatever is found is remembered for the next start.
+    """
+
+    CACHE_TIMEOUT = 1.0
+    MAX_AGE = 30 * 24 * 60 * 60
+
+    def __init__(self, cache, fallback=None, timeout=CACHE_TIMEOUT,
+                 max_age=MAX_AGE):
+        self.cache = cache
+        self.fallback = fallback or DefaultDiscovery()
+        self.timeout = timeout
+        self.max_age = max_age
+
+    async def discover(self):
+        async with httpx.AsyncClient() as client:
+            for key, host in self.cache.recent(self.max_age):
+                connection_info = UnauthenticatedHueRawConnectionInfo(host)
+                if not await connection_info.validate(self.timeout, client):
+                    continue
+                # A different bridge may have taken over the address.
+                if (connection_info.bridge_id or host) != key:
+                    continue
+                self.cache.remember(connection_info)
+                return connection_info
+
+        connection_info = await self.fallback.discover()
+        self.cache.remember(connection_info)
+        return connection_info
+
+
+def mdns_bridge_id(info):
+    """
+    Returns the bridge id advertised by a bridge's mDNS service, in the same
+    form as the serial number in its description.xml, or None.
+    """
+    value = (info.properties or {}).get(b"bridgeid")
+    if not value:
+        return None
+    bridge_id = value.decode("ascii", "ignore").lower()
+    # The advertised id is the MAC address with "fffe" in the middle.
+    if len(bridge_id) == 16 and bridge_id[6:10] == "fffe":
+        bridge_id = bridge_id[:6] + bridge_id[10:]
+    return bridge_id
+
+
+class BridgeWatcher(object):
+    """
+    Keeps browsing mDNS in the background and tracks the current address of
+    every bridge, keyed by bridge id. Managers attached to a bridge get their
+    connection_info.host updated in place when the bridge moves, so they keep
+    working without being recreated; their event streams started with
+    reconnect=True are reopened against the new address.
+    """
+
+    def __init__(self):
+        self.addresses = {}
+        # Bridges currently advertised over mDNS.
+        self.online = set()
+        self.managers = {}
+        self._bridge_ids = {}
+        self._aio_zc = None
+        self._browser = None
+
+    def attach(self, bridge_id, manager):
+        self.managers.setdefault(bridge_id, []).append(manager)
+        host = self.addresses.get(bridge_id)
+        if host is not None:
+            manager.connection_info.host = host
+
+    def detach(self, bridge_id, manager):
+        managers = self.managers.get(bridge_id, [])
+        if manager in managers:
+            managers.remove(manager)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+
+        def on_service(info):
+            if info:
+                loop.call_soon_threadsafe(self.service_changed, info)
+
+        def on_removed(name):
+            loop.call_soon_threadsafe(self.service_removed, name)
+
+        self._aio_zc = AsyncZeroconf()
+        listener = MDNSListener(on_service, on_removed)
+        self._browser = ServiceBrowser(self._aio_zc.zeroconf,
+                                       "_hue._tcp.local.", listener)
+
+    async def stop(self):
+        if self._browser is not None:
+            self._browser.cancel()
+            self._browser = None
+        if self._aio_zc is not None:
+            await self._aio_zc.async_close()
+            self._aio_zc = None
+
+    def service_changed(self, info):
+        if not info.addresses:
+            return
+        bridge_id = mdns_bridge_id(info) or info.name
+        host = socket.inet_ntoa(info.addresses[0])
+        self._bridge_ids[info.name] = bridge_id
+        self.online.add(bridge_id)
+        if self.addresses.get(bridge_id) == host:
+            return
+
+        self.addresses[bridge_id] = host
+        for manager in self.managers.get(bridge_id, []):
+            manager.connection_info.host = host
+            manager.reconnect_events()
+
+    def service_removed(self, name):
+        # The last known address is kept, as the bridge may come back there.
+        self.online.discard(self._bridge_ids.pop(name, None))
@@ -0,0 +1,192 @@
+"""
+Contains the Hue Entertainment (HueStream) frame encoder and a sender that
+streams frames to the bridge over UDP at a fixed rate.
+
+The bridge only accepts HueStream over DTLS (PSK); plain UDP works with local
+receivers. A DTLS transport can be plugged in by implementing the same
+interface as UDPTransport.
+"""
+
+import struct
+import asyncio
+from typing import Dict, List, Sequence, Tuple
+
+from .core import Light
+
+HUESTREAM_PORT = 2100
+COLOR_SPACE_RGB = 0x00
+COLOR_SPACE_XY = 0x01
+
+PROTOCOL_NAME = b"HueStream"
+# Protocol name, major/minor version, sequence id, 2 reserved bytes, color
+# space, 1 reserved byte.
+HEADER_FORMAT = struct.Struct(">9sBBBxxBx")
+V1_LIGHT_FORMAT = struct.Struct(">BHHHH")
+V2_CHANNEL_FORMAT = struct.Struct(">BHHH")
+V1_MAX_LIGHTS = 10
+V2_MAX_CHANNELS = 20
+
+Channels = Tuple[float, float, float]
+
+
+def to_uint16(value: float) -> int:
+    """ Scales a value in [0, 1] to a 16-bit channel. """
+    return int(max(0.0, min(value, 1.0)) * 0xFFFF)
+
+
+def encode_frame_v1(lights: Sequence[Tuple[int, Channels]],
+                    color_space: int = COLOR_SPACE_RGB,
+                    sequence: int = 0) -> bytes:
+    """
+    Encodes a HueStream v1 frame. `lights` is a list of (light_id, values),
+    with values being (r, g, b) or (x, y, brightness) in [0, 1].
+    """
+    if len(lights) > V1_MAX_LIGHTS:
+        raise ValueError(f"At most {V1_MAX_LIGHTS} lights per frame.")
+
+    parts = [
+        HEADER_FORMAT.pack(PROTOCOL_NAME, 1, 0, sequence & 0xFF, color_space)
+    ]
+    for light_id, (c1, c2, c3) in lights:
+        parts.append(
+            V1_LIGHT_FORMAT.pack(0x00, light_id, to_uint16(c1), to_uint16(c2),
+                                 to_uint16(c3)))
+    return b"".join(parts)
+
+
+def encode_frame_v2(entertainment_id: str,
+                    channels: Sequence[Tuple[int, Channels]],
+                    color_space: int = COLOR_SPACE_RGB,
+                    sequence: int = 0) -> bytes:
+    """
+    Encodes a HueStream v2 frame for the entertainment configuration with the
+    given (36 character) id. `channels` is a list of (channel_id, values).
+    """
+    if len(entertainment_id) != 36:
+        raise ValueError("Entertainment configuration id must be a UUID.")
+    if len(channels) > V2_MAX_CHANNELS:
+        raise ValueError(f"At most {V2_MAX_CHANNELS} channels per frame.")
+
+    parts = [
+        HEADER_FORMAT.pack(PROTOCOL_NAME, 2, 0, sequence & 0xFF, color_space),
+        entertainment_id.encode("ascii")
+    ]
+    for channel_id, (c1, c2, c3) in channels:
+        parts.append(
+            V2_CHANNEL_FORMAT.pack(channel_id, to_uint16(c1), to_uint16(c2),
+                                   to_uint16(c3)))
+    return b"".join(parts)
+
+
+def streamable_lights(lights: List[Light]) -> List[Light]:
+    """ Returns the lights that can render entertainment streams. """
+    result = []
+    for light in lights:
+        streaming = light.capabilities.streaming
+        if isinstance(streaming, dict) and streaming.get("renderer"):
+            result.append(light)
+    return result
+
+
+class UDPTransport(object):
+    """ Sends datagrams to host:port without encryption. """
+
+    def __init__(self, host: str, port: int = HUESTREAM_PORT):
+        self.host = host
+        self.port = port
+        self._transport = None
+
+    async def connect(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, remote_addr=(self.host, self.port))
+
+    def send(self, data: bytes) -> None:
+        self._transport.sendto(data)
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+
+class EntertainmentStreamer(object):
+    """
+    Sends the latest colors of a set of lights (v1) or channels (v2) at a
+    fixed frame rate from a background task. The bridge expects a continuous
+    stream, so the last frame is repeated until it is changed.
+    """
+
+    def __init__(self,
+                 transport: UDPTransport,
+                 ids: List[int],
+                 rate: float = 25.0,
+                 color_space: int = COLOR_SPACE_RGB,
+                 entertainment_id: str | None = None):
+        if rate <= 0:
+            raise ValueError("Frame rate must be positive.")
+        max_ids = V2_MAX_CHANNELS if entertainment_id else V1_MAX_LIGHTS
+        if len(ids) > max_ids:
+            raise ValueError(f"At most {max_ids} lights can be streamed.")
+
+        self.transport = transport
+        self.rate = rate
+        self.color_space = color_space
+        self.entertainment_id = entertainment_id
+        self.colors: Dict[int, Channels] = {x: (0.0, 0.0, 0.0) for x in ids}
+        self.sequence = 0
+        self.frames_sent = 0
+        self._task: asyncio.Task | None = None
+
+    @classmethod
+    def from_lights(cls, transport: UDPTransport, lights: List[Light],
+                    **kwargs) -> "EntertainmentStreamer":
+        """ Creates a v1 streamer, rejecting lights that can't stream. """
+        renderers = streamable_lights(lights)
+        if len(renderers) != len(lights):
+            raise ValueError("Some lights do not support streaming.")
+        return cls(transport, [int(x._model.id) for x in lights], **kwargs)
+
+    def set_color(self, light_id: int, values: Channels) -> None:
+        """ Sets (r, g, b) or (x, y, brightness), each in [0, 1]. """
+        if light_id not in self.colors:
+            raise KeyError(light_id)
+        self.colors[light_id] = values
+
+    def encode(self) -> bytes:
+        items = list(self.colors.items())
+        if self.entertainment_id:
+            return encode_frame_v2(self.entertainment_id, items,
+                                   self.color_space, self.sequence)
+        return encode_frame_v1(items, self.color_space, self.sequence)
+
+    async def start(self) -> None:
+        await self.transport.connect()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.transport.close()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.rate
+        next_frame = loop.time()
+        while True:
+            self.transport.send(self.encode())
+            self.sequence = (self.sequence + 1) & 0xFF
+            self.frames_sent += 1
+
+            next_frame += interval
+            delay = next_frame - loop.time()
+            if delay < 0:
+                # Fell behind; skip the missed frames rather than bursting.
+                next_frame = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
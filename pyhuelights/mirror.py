@@ -0,0 +1,179 @@
+""" Contains an in-memory mirror of the bridge's lights and groups. """
+
+import asyncio
+from typing import Any, AsyncGenerator, Dict, List, Tuple
+
+from .core import Light, LightsManager
+from .model import EMPTY, Group
+
+
+class BridgeStateMirror(object):
+    """
+    Loads lights and groups once and keeps them current from the bridge's
+    event stream, so that reads are local dict lookups.
+    """
+
+    def __init__(self, manager: LightsManager):
+        self.manager = manager
+        self.lights: Dict[str, Light] = {}
+        self.groups: Dict[str, Group] = {}
+        self._task: asyncio.Task | None = None
+        self._lights_by_unique_id: Dict[str, Light] = {}
+        self._lights_by_name: Dict[str, Light] = {}
+        self._groups_by_name: Dict[str, Group] = {}
+        self._groups_by_light: Dict[str, List[Group]] = {}
+        self._groups_by_class: Dict[str, List[Group]] = {}
+        self._groups_by_type: Dict[str, List[Group]] = {}
+        self._indexed_groups = 0
+        # What each light and group was indexed as, keyed by their ids.
+        self._light_index_keys: Dict[str, Tuple[Any, ...]] = {}
+        self._group_index_keys: Dict[str, Tuple[Any, ...]] = {}
+
+    async def load(self) -> None:
+        """ Fetches all lights and groups from the bridge. """
+        self.lights = await self.manager.get_all_lights()
+        self.groups = await self.manager.get_all_groups()
+        self.reindex()
+
+    def reindex(self) -> None:
+        """ Rebuilds all lookup indexes from self.lights and self.groups. """
+        self._lights_by_unique_id = {
+            light._model.unique_id: light
+            for light in self.lights.values()
+        }
+        self._lights_by_name = {
+            light._model.name: light
+            for light in self.lights.values()
+        }
+        self._light_index_keys = {
+            light_id: self._light_keys(light)
+            for light_id, light in self.lights.items()
+        }
+        self._group_index_keys = {
+            group_id: self._group_keys(group)
+            for group_id, group in self.groups.items()
+        }
+        self._groups_by_name = {}
+        self._groups_by_light = {}
+        self._groups_by_class = {}
+        self._groups_by_type = {}
+        self._indexed_groups = len(self.groups)
+        for group in self.groups.values():
+            self._groups_by_name[group.name] = group
+            self._groups_by_type.setdefault(group.type, []).append(group)
+            if group.group_class is not EMPTY:
+                self._groups_by_class.setdefault(group.group_class,
+                                                 []).append(group)
+            if group.lights is not EMPTY:
+                for light_id in group.lights:
+                    self._groups_by_light.setdefault(light_id,
+                                                     []).append(group)
+
+    async def iter_events(self) -> AsyncGenerator[Light | Group, None]:
+        """
+        Applies events from the bridge to the mirror, yielding every light
+        and group that changed.
+        """
+        resyncs = self.manager.event_stats.resyncs
+        async for changed in self.manager.iter_events(self.lights,
+                                                      reconnect=True,
+                                                      groups=self.groups):
+            if (resyncs != self.manager.event_stats.resyncs
+                    or self._is_stale(changed)):
+                resyncs = self.manager.event_stats.resyncs
+                self.reindex()
+            yield changed
+
+    def _counts_changed(self) -> bool:
+        return (len(self.lights) != len(self._lights_by_unique_id)
+                or len(self.groups) != self._indexed_groups)
+
+    def _ensure_indexed(self) -> None:
+        # Deletions are not yielded by iter_events(), so they are caught here.
+        if self._counts_changed():
+            self.reindex()
+
+    @staticmethod
+    def _light_keys(light: Light) -> Tuple[Any, ...]:
+        return (light, light._model.unique_id, light._model.name)
+
+    @staticmethod
+    def _group_keys(group: Group) -> Tuple[Any, ...]:
+        lights = group.lights
+        return (group, group.name, group.type, group.group_class,
+                tuple(lights) if lights is not EMPTY else lights)
+
+    def _is_stale(self, changed: Light | Group) -> bool:
+        """
+        Whether the indexes miss a change that came with an event, i.e. the
+        changed light or group no longer matches what it was indexed as.
+        """
+        if self._counts_changed():
+            return True
+        if isinstance(changed, Group):
+            return (self._group_index_keys.get(changed.id) !=
+                    self._group_keys(changed))
+        return (self._light_index_keys.get(changed._model.id) !=
+                self._light_keys(changed))
+
+    async def run(self) -> None:
+        """ Keeps the mirror current until cancelled. """
+        async for _ in self.iter_events():
+            pass
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def light(self, light_id: str) -> Light | None:
+        return self.lights.get(light_id)
+
+    def light_by_unique_id(self, unique_id: str) -> Light | None:
+        self._ensure_indexed()
+        return self._lights_by_unique_id.get(unique_id)
+
+    def light_by_name(self, name: str) -> Light | None:
+        self._ensure_indexed()
+        return self._lights_by_name.get(name)
+
+    def group(self, group_id: str) -> Group | None:
+        return self.groups.get(group_id)
+
+    def group_by_name(self, name: str) -> Group | None:
+        self._ensure_indexed()
+        return self._groups_by_name.get(name)
+
+    def groups_of_light(self, light_id: str) -> List[Group]:
+        self._ensure_indexed()
+        return list(self._groups_by_light.get(light_id, []))
+
+    def lights_in_group(self, group_id: str) -> List[Light]:
+        group = self.groups.get(group_id)
+        if group is None or group.lights is EMPTY:
+            return []
+        return [self.lights[x] for x in group.lights if x in self.lights]
+
+    def groups_by_class(self, group_class: str) -> List[Group]:
+        """ Returns groups by their class, e.g. 'Living room'. """
+        self._ensure_indexed()
+        return list(self._groups_by_class.get(group_class, []))
+
+    def rooms(self) -> List[Group]:
+        self._ensure_indexed()
+        return list(self._groups_by_type.get("Room", []))
+
+    def room_of_light(self, light_id: str) -> Group | None:
+        self._ensure_indexed()
+        for group in self._groups_by_light.get(light_id, []):
+            if group.type == "Room":
+                return group
+        return None
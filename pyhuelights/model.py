@@ -1,6 +1,6 @@
 """ Contains models and dirty tracking logic. """
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field as dataclass_field, replace
 from typing import Type, Callable, Any
 from collections.abc import Collection
 
@@ -20,17 +20,55 @@ def contains(params):
 
 
 class HueResource(object):
+    """
+    Base class for all models. Field values live in per-instance lists indexed
+    by the field's position in FIELDS, and dirty flags are packed into an int.
+    """
+
+    __slots__ = ("parent", "attr_in_parent", "values", "orig_values",
+                 "dirty_mask")
+    FIELDS = []
+
+    def __init_subclass__(cls, **kwargs):
+        """
+        Installs field properties and precomputes the per-class lookups once,
+        instead of redoing it for every instance.
+        """
+        super().__init_subclass__(**kwargs)
+        # Each class gets its own copies, as a field's index depends on the
+        # class it is installed in and Fields may be shared between classes.
+        cls.FIELDS = [replace(field) for field in cls.FIELDS]
+        cls.property_to_json_key_map = {}
+        cls.field_index = {}
+        cls.flag_fields = []  # Fields reported by dirty_flag.
+        cls.dirty_fields = []  # Fields that can be set in dirty_mask.
+        for index, field in enumerate(cls.FIELDS):
+            field.install(cls, index)
+            cls.property_to_json_key_map[field.prop_name()] = field.json_name()
+            cls.field_index[field.prop_name()] = index
+            if not field.is_key:
+                cls.flag_fields.append(field)
+            if field.can_be_dirty():
+                cls.dirty_fields.append(field)
+        cls.empty_values = (EMPTY, ) * len(cls.FIELDS)
 
     def __init__(self, parent=None, attr_in_parent=None):
         self.parent = parent
         self.attr_in_parent = attr_in_parent
-        self.dirty_flag = {}  # Keyed by python property names.
-        self.data = {}
-        self.property_to_json_key_map = {}
-        for field in self.FIELDS:
-            field.init_object(self)
-            self.property_to_json_key_map[
-                field.prop_name()] = field.json_name()
+        self.values = list(self.empty_values)
+        self.orig_values = list(self.empty_values)
+        self.dirty_mask = 0
+
+    @property
+    def dirty_flag(self):
+        """ Dirty flags keyed by python property names (read-only view). """
+        return {
+            field.prop_name(): bool(self.dirty_mask & (1 << field.index))
+            for field in self.flag_fields
+        }
+
+    def is_dirty(self, prop_name):
+        return bool(self.dirty_mask & (1 << self.field_index[prop_name]))
 
     def relative_url(self):
         """
@@ -39,25 +77,18 @@ class HueResource(object):
         return ""
 
     def commit(self, prop_name=None):
-        if prop_name and prop_name in self.dirty_flag:
-            value = getattr(self, prop_name)
-            if isinstance(value, HueResource):
-                value.commit()
-            else:
-                self.data[prop_name + "_orig"] = value
-            self.dirty_flag[prop_name] = False
-        else:
-            for key in self.dirty_flag:
-                self.commit(prop_name=key)
+        for field in self.dirty_fields:
+            if prop_name is None or field.prop_name() == prop_name:
+                field.commit(self)
 
     def reset(self):
-        for field in self.FIELDS:
-            if field.can_be_dirty() and field.prop_name() in self.dirty_flag:
-                field.reset(self)
+        for field in self.dirty_fields:
+            field.reset(self)
 
     def __str__(self):
         return self.__class__.__name__ + "(" + ", ".join(
-            str(k) + "=" + str(v) for k, v in self.data.items()) + ")"
+            field.prop_name() + "=" + str(value)
+            for field, value in zip(self.FIELDS, self.values)) + ")"
 
 
 @dataclass
@@ -72,6 +103,7 @@ class Field(object):
     validator: Callable[..., bool] = None
     from_json_converter: Any = lambda x: x
     to_json_converter: Any = lambda x: x
+    index: int = dataclass_field(default=-1, init=False, repr=False)
 
     def prop_name(self):
         return self.obj_prop_name
@@ -84,22 +116,16 @@ class Field(object):
             return False
         return self.writable or self.cls is not None
 
-    def init_object(self, obj):
-        if (self.cls or self.writable) and not self.is_key:
-            obj.dirty_flag[self.prop_name()] = False
-
-        if self.optional or not self.parse:
-            obj.data[self.prop_name()] = EMPTY
-            obj.data[self.prop_name() + "_orig"] = EMPTY
-
+    def install(self, cls, index):
+        """ Binds this field to its slot index and adds its class property. """
+        self.index = index
         field = self
 
         def getter_func(self):
-            return self.data[field.prop_name()]
+            return self.values[index]
 
         def setter_func(self, val):
-            if (field.optional
-                    and self.data.get(field.prop_name(), EMPTY) is EMPTY):
+            if field.optional and self.values[index] is EMPTY:
                 raise ValueError("Unsupported operation on this field.")
 
             if field.validator and not field.validator(val):
@@ -107,27 +133,34 @@ class Field(object):
 
             # No conversion to val, because the caller provided value would be
             # already converted. Converters are for JSON-parsing.
-            self.data[field.prop_name()] = val
+            self.values[index] = val
 
             # Walk up the hierarchy and set the dirty flags.
             current_obj = self
             current_attr = field.prop_name()
             while current_obj is not None:
-                current_obj.dirty_flag[current_attr] = True
+                current_obj.dirty_mask |= 1 << current_obj.field_index[
+                    current_attr]
                 current_attr = current_obj.attr_in_parent
                 current_obj = current_obj.parent
 
-        kwargs = {"fget": getter_func}
+        def nested_getter_func(self):
+            value = self.values[index]
+            if value.__class__ is dict:
+                value = field.materialize(self, value)
+            return value
+
+        kwargs = {"fget": nested_getter_func if self.cls else getter_func}
         if self.writable and not self.cls and not self.is_key:
             kwargs["fset"] = setter_func
-        setattr(obj.__class__, self.prop_name(), property(**kwargs))
+        setattr(cls, self.prop_name(), property(**kwargs))
 
-    def update(self, obj, key, json):
+    def update(self, obj, key, json, lazy=False):
         if not self.parse:
             return
 
         if self.is_key:
-            obj.data[self.prop_name()] = key
+            obj.values[self.index] = key
             return
 
         if self.cls:
@@ -136,32 +169,50 @@ class Field(object):
                 raise ValueError(
                     f"Expected object for: {self}, in {json} at " +
                     self.json_name())
-            value = self.cls(parent=obj, attr_in_parent=self.prop_name())
-            update_from_object(value, None, json[self.json_name()])
-            obj.dirty_flag[self.prop_name()] = False
-            obj.data[self.prop_name()] = value
+            obj.dirty_mask &= ~(1 << self.index)
+            if lazy:
+                # Kept as raw JSON until first accessed.
+                obj.values[self.index] = json[self.json_name()]
+            else:
+                self.materialize(obj, json[self.json_name()])
         elif self.json_name() in json:
             val = self.from_json_converter(json[self.json_name()])
-            obj.data[self.prop_name()] = val
-            obj.data[self.prop_name() + "_orig"] = val
-            obj.dirty_flag[self.prop_name()] = False
+            obj.values[self.index] = val
+            obj.orig_values[self.index] = val
+            obj.dirty_mask &= ~(1 << self.index)
         elif self.optional and self.json_name() not in json:
-            obj.data[self.prop_name()] = EMPTY
-            # init_object takes care of self.prop_name() + "_orig".
+            obj.values[self.index] = EMPTY
         else:
             raise ValueError("Field absent in response: " + self.json_name())
 
+    def materialize(self, obj, json):
+        """ Builds the nested resource of a cls field from its JSON. """
+        value = self.cls(parent=obj, attr_in_parent=self.prop_name())
+        update_from_object(value, None, json)
+        obj.values[self.index] = value
+        return value
+
+    def commit(self, obj):
+        value = obj.values[self.index]
+        if isinstance(value, HueResource):
+            value.commit()
+        elif not self.cls:
+            obj.orig_values[self.index] = value
+        obj.dirty_mask &= ~(1 << self.index)
+
     def reset(self, obj):
         if self.cls:
-            getattr(obj, self.prop_name()).reset()
+            if isinstance(obj.values[self.index], HueResource):
+                obj.values[self.index].reset()
         else:
-            obj.data[self.prop_name()] = obj.data[self.prop_name() + "_orig"]
-        obj.dirty_flag[self.prop_name()] = False
+            obj.values[self.index] = obj.orig_values[self.index]
+        obj.dirty_mask &= ~(1 << self.index)
 
 
 class HueApp(HueResource):
     """ Represents Hue App. """
 
+    __slots__ = ("app_name", "client_name")
     FIELDS = []
 
     def __init__(self, app_name, client_name):
@@ -173,6 +224,7 @@ class HueApp(HueResource):
 class LightState(HueResource):
     """ Represents the state of the light (colors, brightness etc). """
 
+    __slots__ = ()
     FIELDS = [
         Field(obj_prop_name="on"),
         Field(obj_prop_name="reachable", writable=False),
@@ -217,6 +269,7 @@ class LightState(HueResource):
 class LightCapabilities(HueResource):
     """ Represents the capabilities of the light. """
 
+    __slots__ = ()
     FIELDS = [
         Field(obj_prop_name="control",
               parse_json_name="control",
@@ -229,6 +282,7 @@ class LightCapabilities(HueResource):
 
 
 class Light(HueResource):
+    __slots__ = ()
     FIELDS = [
         Field(obj_prop_name="id", is_key=True),
         Field(obj_prop_name="unique_id",
@@ -259,6 +313,7 @@ class Light(HueResource):
 class GroupState(HueResource):
     """ Represents the state of the lights in group. """
 
+    __slots__ = ()
     FIELDS = [
         Field(obj_prop_name="on"),
         Field(obj_prop_name="reachable", writable=False, optional=True),
@@ -276,6 +331,7 @@ class GroupState(HueResource):
 
 
 class Group(HueResource):
+    __slots__ = ()
     FIELDS = [
         Field(obj_prop_name="id", is_key=True),
         Field(obj_prop_name="lights", optional=True),
@@ -292,9 +348,58 @@ class Group(HueResource):
     ]
 
     def relative_url(self):
-        return "/groups/" + self.id
+        return Group.make_relative_url(self.id)
+
+    @classmethod
+    def make_relative_url(self, group_id):
+        return "/groups/" + group_id
+
 
+class Scene(HueResource):
+    """ Stored light states that the bridge can recall in one command. """
 
-def update_from_object(resource, key, json):
+    __slots__ = ()
+    FIELDS = [
+        Field(obj_prop_name="id", is_key=True),
+        Field(obj_prop_name="name"),
+        Field(obj_prop_name="type", writable=False, optional=True),
+        Field(obj_prop_name="group", writable=False, optional=True),
+        Field(obj_prop_name="lights", optional=True),
+        Field(obj_prop_name="owner", writable=False, optional=True),
+        Field(obj_prop_name="recycle", writable=False, optional=True),
+        Field(obj_prop_name="locked", writable=False, optional=True),
+        Field(obj_prop_name="light_states",
+              parse_json_name="lightstates",
+              optional=True),
+    ]
+
+    def relative_url(self):
+        return Scene.make_relative_url(self.id)
+
+    @classmethod
+    def make_relative_url(self, scene_id):
+        return "/scenes/" + scene_id
+
+
+def update_from_object(resource, key, json, lazy=False):
+    """
+    Parses json into resource. With lazy=True, nested resources keep their
+    raw JSON and are only parsed when first accessed.
+    """
     for field in resource.FIELDS:
-        field.update(resource, key, json)
+        field.update(resource, key, json, lazy)
+
+
+def patch_from_object(resource, json):
+    """
+    Updates only the fields present in json, leaving the others untouched.
+    Nested resources are patched in place.
+    """
+    for field in resource.FIELDS:
+        if not field.parse or field.is_key or field.json_name() not in json:
+            continue
+        if field.cls and isinstance(json[field.json_name()], dict):
+            patch_from_object(getattr(resource, field.prop_name()),
+                              json[field.json_name()])
+        else:
+            field.update(resource, None, json)
@@ -1,9 +1,13 @@
 """ Contains network management logic. """
 
 import json
-from typing import Any, Callable, Dict, Type, AsyncGenerator
+import time
+import random
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Set, Type, AsyncGenerator
 import httpx
-from httpx_sse import aconnect_sse
+from httpx_sse import aconnect_sse, SSEError
 
 from .model import HueResource, update_from_object
 from .exceptions import RequestFailed
@@ -24,39 +28,388 @@ def dict_parser(
     return parser
 
 
-def construct_body(obj: HueResource | None) -> Dict[str, Any] | None:
+def construct_body(obj: HueResource | None,
+                   changed_only: bool = False) -> Dict[str, Any] | None:
+    """
+    Builds the JSON body for the dirty fields of obj. With changed_only=True,
+    fields whose value equals the last-known bridge value (orig_values) are
+    left out, and if only request modifiers such as transition_time remain,
+    the body is empty.
+    """
     if obj is None:
         return None
 
     result = {}
+    has_changes = False
     for field in obj.FIELDS:
-        if obj.dirty_flag.get(field.prop_name(), False):
-            field_value = getattr(obj, field.prop_name())
+        if obj.dirty_mask & (1 << field.index):
+            field_value = obj.values[field.index]
             if isinstance(field_value, HueResource):
-                transformed_value = construct_body(field_value)
+                transformed_value = construct_body(field_value, changed_only)
+                if changed_only and not transformed_value:
+                    continue
+                has_changes = True
+            elif not field.parse:
+                # Not reported by the bridge, so there is nothing to compare.
+                transformed_value = field.to_json_converter(field_value)
+            elif (changed_only
+                  and field_value == obj.orig_values[field.index]):
+                continue
             else:
                 transformed_value = field.to_json_converter(field_value)
+                has_changes = True
 
             result[obj.property_to_json_key_map[
                 field.prop_name()]] = transformed_value
 
+    if changed_only and not has_changes:
+        return {}
     return result
 
 
+def field_addresses(obj: HueResource,
+                    base_url: str | None = None) -> Dict[str, Any]:
+    """
+    Maps the bridge address of each dirty field of obj, as reported in update
+    responses (e.g. "/lights/1/state/bri"), to its (resource, field) pair.
+    base_url stands in for obj.relative_url(), e.g. for a group's action.
+    """
+    if base_url is None:
+        base_url = obj.relative_url()
+
+    result = {}
+    for field in obj.dirty_fields:
+        if not obj.dirty_mask & (1 << field.index):
+            continue
+        address = base_url + "/" + field.json_name()
+        value = obj.values[field.index]
+        if isinstance(value, HueResource):
+            result.update(field_addresses(value, address))
+        else:
+            result[address] = (obj, field)
+    return result
+
+
+def apply_update_response(obj: HueResource,
+                          response: Any,
+                          base_url: str | None = None) -> None:
+    """
+    Commits the fields of obj that the bridge acknowledged in `success`
+    entries of response and resets those it rejected in `error` entries.
+    Fields the response does not mention stay dirty. Request modifiers such
+    as transition_time are committed, as they only apply to one request.
+    """
+    addresses = field_addresses(obj, base_url)
+    for entry in response if isinstance(response, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        if isinstance(entry.get("success"), dict):
+            for address in entry["success"]:
+                if address in addresses:
+                    resource, field = addresses.pop(address)
+                    field.commit(resource)
+        elif isinstance(entry.get("error"), dict):
+            address = entry["error"].get("address")
+            if address in addresses:
+                resource, field = addresses.pop(address)
+                field.reset(resource)
+
+    for resource, field in addresses.values():
+        if not field.parse:
+            field.commit(resource)
+    _clear_clean_parents(obj)
+
+
+def commit_unchanged(obj: HueResource) -> None:
+    """
+    Commits the dirty fields of obj that already hold the last-known bridge
+    value, i.e. those construct_body(obj, changed_only=True) leaves out.
+    """
+    for field in obj.dirty_fields:
+        if not obj.dirty_mask & (1 << field.index):
+            continue
+        value = obj.values[field.index]
+        if isinstance(value, HueResource):
+            commit_unchanged(value)
+        elif field.parse and value == obj.orig_values[field.index]:
+            field.commit(obj)
+    _clear_clean_parents(obj)
+
+
+def _clear_clean_parents(obj: HueResource) -> None:
+    """ Clears the dirty bits of nested resources with nothing left dirty. """
+    for field in obj.dirty_fields:
+        value = obj.values[field.index]
+        if isinstance(value, HueResource):
+            _clear_clean_parents(value)
+            if not value.dirty_mask:
+                obj.dirty_mask &= ~(1 << field.index)
+
+
+async def until_set(events: AsyncGenerator[Any, None],
+                    stop: asyncio.Event) -> AsyncGenerator[Any, None]:
+    """
+    Yields from events until they run out or stop is set, even while waiting
+    for the next one.
+    """
+    stopped = asyncio.ensure_future(stop.wait())
+    pending = None
+    try:
+        while True:
+            pending = asyncio.ensure_future(anext(events, stop))
+            await asyncio.wait((pending, stopped),
+                               return_when=asyncio.FIRST_COMPLETED)
+            if not pending.done():
+                return
+            item = pending.result()
+            if item is stop:
+                return
+            yield item
+    finally:
+        stopped.cancel()
+        if pending is not None and not pending.done():
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        await events.aclose()
+
+
+class TokenBucket(object):
+    """
+    Allows `rate` acquisitions per second on average, with bursts of up to
+    `capacity`. Waiters are served in FIFO order.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+def merge_body(target: Dict[str, Any], update: Dict[str, Any]) -> None:
+    """ Recursively merges update into target; values in update win. """
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge_body(target[key], value)
+        else:
+            target[key] = value
+
+
+@dataclass
+class SchedulerMetrics:
+    """ Queueing statistics for one bucket of a CommandScheduler. """
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    sent: int = 0
+    coalesced: int = 0
+    total_wait_time: float = 0.0
+    max_wait_time: float = 0.0
+
+    @property
+    def average_wait_time(self) -> float:
+        return self.total_wait_time / self.sent if self.sent else 0.0
+
+
+class PendingUpdate(object):
+    """
+    An update that is waiting for its bucket, shared by merged callers. It is
+    sent by its own task, so that it survives any one caller being cancelled.
+    """
+
+    def __init__(self, body: Dict[str, Any] | None):
+        self.body = body
+        self.future = asyncio.get_running_loop().create_future()
+        self.waiters = 0
+        self.task: asyncio.Task | None = None
+
+
+class CommandScheduler(object):
+    """
+    Throttles outgoing resource updates so that the bridge is not flooded.
+    Light and group commands are limited by separate token buckets; other
+    URLs are sent right away.
+
+    With coalesce=True, an update for a URL that already has an update
+    waiting is merged into it instead of being queued: only the latest value
+    of every field is sent, and all merged callers get the same response.
+    """
+
+    LIGHTS_RATE = 10.0
+    GROUPS_RATE = 1.0
+
+    def __init__(self,
+                 lights_rate: float = LIGHTS_RATE,
+                 groups_rate: float = GROUPS_RATE,
+                 coalesce: bool = False):
+        self.buckets = {
+            "lights": TokenBucket(lights_rate),
+            "groups": TokenBucket(groups_rate),
+        }
+        self.metrics = {key: SchedulerMetrics() for key in self.buckets}
+        self.coalesce = coalesce
+        self.pending: Dict[str, PendingUpdate] = {}
+
+    def bucket_key(self, relative_url: str) -> str | None:
+        for key in self.buckets:
+            if relative_url.startswith("/" + key + "/"):
+                return key
+        return None
+
+    async def schedule(self, relative_url: str, body: Dict[str, Any] | None,
+                       send: Callable[[Dict[str, Any] | None],
+                                      Awaitable[Any]]) -> Any:
+        """ Waits for the bucket of relative_url, then awaits send(body). """
+        key = self.bucket_key(relative_url)
+        if key is None:
+            return await send(body)
+
+        if not self.coalesce:
+            await self._acquire(key)
+            return await send(body)
+
+        pending = self.pending.get(relative_url)
+        if pending is None:
+            pending = PendingUpdate(body if body is not None else {})
+            self.pending[relative_url] = pending
+            pending.task = asyncio.create_task(
+                self._send_pending(relative_url, key, pending, send))
+        else:
+            merge_body(pending.body, body or {})
+            self.metrics[key].coalesced += 1
+
+        pending.waiters += 1
+        try:
+            return await asyncio.shield(pending.future)
+        finally:
+            pending.waiters -= 1
+            # Only drop the update once every merged caller has given up.
+            if pending.waiters == 0 and not pending.future.done():
+                if self.pending.get(relative_url) is pending:
+                    del self.pending[relative_url]
+                pending.task.cancel()
+
+    async def _acquire(self, key: str) -> None:
+        metrics = self.metrics[key]
+        metrics.queue_depth += 1
+        metrics.max_queue_depth = max(metrics.max_queue_depth,
+                                      metrics.queue_depth)
+        started = time.monotonic()
+        try:
+            await self.buckets[key].acquire()
+        finally:
+            metrics.queue_depth -= 1
+
+        waited = time.monotonic() - started
+        metrics.sent += 1
+        metrics.total_wait_time += waited
+        metrics.max_wait_time = max(metrics.max_wait_time, waited)
+
+    async def _send_pending(self, relative_url: str, key: str,
+                            pending: PendingUpdate,
+                            send: Callable[[Dict[str, Any] | None],
+                                           Awaitable[Any]]) -> None:
+        try:
+            try:
+                await self._acquire(key)
+            finally:
+                # Later updates for the URL start a new batch from here on.
+                if self.pending.get(relative_url) is pending:
+                    del self.pending[relative_url]
+            pending.future.set_result(await send(pending.body))
+        except asyncio.CancelledError:
+            pending.future.cancel()
+            raise
+        except Exception as exc:
+            pending.future.set_exception(exc)
+
+
+# Change yielded by iter_events() after a reconnection, when events may have
+# been missed and the caller should refresh its state.
+RESYNC_EVENT_TYPE = "resync"
+
+
+@dataclass
+class EventStreamStats:
+    """ Counters for BaseResourceManager.iter_events(reconnect=True). """
+    reconnects: int = 0
+    resyncs: int = 0
+
+
 class BaseResourceManager(object):
+    """
+    Talks to the bridge over one pooled HTTP/1.1 client that is shared by
+    REST calls and the event stream. Use as an async context manager, or call
+    aclose() when done.
+    """
+
     APIS = {}
+    # The bridge only handles a handful of simultaneous connections.
+    DEFAULT_LIMITS = httpx.Limits(max_connections=8,
+                                  max_keepalive_connections=8,
+                                  keepalive_expiry=60.0)
+    DEFAULT_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+    RECONNECT_BASE_DELAY = 0.5
+    RECONNECT_MAX_DELAY = 30.0
 
     def __init__(self,
                  connection_info: Any,
-                 client: httpx.AsyncClient | None = None):
+                 client: httpx.AsyncClient | None = None,
+                 scheduler: CommandScheduler | None = None,
+                 limits: httpx.Limits | None = None,
+                 timeout: httpx.Timeout | None = None,
+                 skip_unchanged: bool = False):
         self.connection_info = connection_info
         self._client = client
+        self._owns_client = client is None
+        self.scheduler = scheduler
+        self.limits = limits or self.DEFAULT_LIMITS
+        self.timeout = timeout or self.DEFAULT_TIMEOUT
+        self.last_event_id: str | None = None
+        self.event_stats = EventStreamStats()
+        # Only safe when the models track the bridge live (e.g. through a
+        # BridgeStateMirror); otherwise another app's change could be masked.
+        self.skip_unchanged = skip_unchanged
+        # Resource updates not sent because they would not change anything.
+        self.suppressed_writes = 0
+        # One event per running iter_events, set by reconnect_events.
+        self._reconnect_requests: Set[asyncio.Event] = set()
+
+    async def __aenter__(self) -> "BaseResourceManager":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
 
     async def get_client(self) -> httpx.AsyncClient:
         if self._client is None:
-            self._client = httpx.AsyncClient(verify=False)
+            self._client = httpx.AsyncClient(verify=False,
+                                             http1=True,
+                                             http2=False,
+                                             limits=self.limits,
+                                             timeout=self.timeout)
         return self._client
 
+    async def aclose(self) -> None:
+        """ Closes the HTTP client if it was created by this manager. """
+        if self._client is not None and self._owns_client:
+            await self._client.aclose()
+            self._client = None
+
     def parse_response(self, obj: Any, **kwargs: Any) -> Any:
         parser = kwargs.pop('parser')
         return parser(obj)
@@ -85,14 +438,62 @@ class BaseResourceManager(object):
                                        relative_url=(relative_url
                                                      or obj.relative_url()))
 
+    def resource_update_body(self,
+                             obj: HueResource) -> Dict[str, Any] | None:
+        """
+        Returns the body for obj's pending changes, or None (counting a
+        suppressed write) if skip_unchanged is set and nothing would change.
+        With skip_unchanged, fields left out as unchanged are committed.
+        """
+        if not self.skip_unchanged:
+            return construct_body(obj)
+
+        body = construct_body(obj, changed_only=True)
+        if not body:
+            self.suppressed_writes += 1
+            return None
+        # Left out of the body, so no response will acknowledge them.
+        commit_unchanged(obj)
+        return body
+
     async def make_resource_update_request(self,
                                            obj: HueResource,
                                            method: str = 'put',
                                            **kwargs: Any) -> Any:
-        return await self.make_request(method=method,
-                                       relative_url=obj.relative_url(),
-                                       body=construct_body(obj),
-                                       **kwargs)
+        """
+        Sends obj's pending changes and commits those the bridge acknowledged
+        (see apply_update_response), so that obj's original values track what
+        the bridge holds. Returns [] without a request if there is nothing to
+        change.
+        """
+        body = self.resource_update_body(obj)
+        if body is None:
+            obj.commit()
+            return []
+
+        result = await self.make_update_request(obj.relative_url(),
+                                                body,
+                                                method=method,
+                                                **kwargs)
+        apply_update_response(obj, result)
+        return result
+
+    async def make_update_request(self,
+                                  relative_url: str,
+                                  body: Dict[str, Any] | None,
+                                  method: str = 'put',
+                                  **kwargs: Any) -> Any:
+        """ Sends body to relative_url, through the scheduler if any. """
+
+        def send(body):
+            return self.make_request(method=method,
+                                     relative_url=relative_url,
+                                     body=body,
+                                     **kwargs)
+
+        if self.scheduler is None:
+            return await send(body)
+        return await self.scheduler.schedule(relative_url, body, send)
 
     async def get_resource(self,
                            resource: HueResource | None = None,
@@ -113,12 +514,97 @@ class BaseResourceManager(object):
 
         raise ValueError("Expected one of resource or <resource_id, typ>")
 
-    async def iter_events(self) -> AsyncGenerator[Dict[str, Any], None]:
-        url = 'https://' + self.connection_info.host + '/eventstream/clip/v2'
-        headers = {'hue-application-key': self.connection_info.username}
-        client = httpx.AsyncClient(verify=False, timeout=None)
-        async with aconnect_sse(client, "GET", url,
-                                headers=headers) as event_source:
-            async for event in event_source.aiter_sse():
-                for change in json.loads(event.data):
-                    yield change
+    def reconnect_delay(self, attempt: int) -> float:
+        """ Exponential backoff with full jitter. """
+        return random.uniform(
+            0,
+            min(self.RECONNECT_MAX_DELAY,
+                self.RECONNECT_BASE_DELAY * 2**attempt))
+
+    def reconnect_events(self) -> None:
+        """
+        Drops the connection of every running event stream, e.g. after
+        connection_info.host changed. Streams started with reconnect=True
+        reopen right away against the current host; others end.
+        """
+        for requested in self._reconnect_requests:
+            requested.set()
+
+    async def iter_events(
+            self,
+            reconnect: bool = False) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Iterates over changes from the bridge's event stream.
+
+        With reconnect=True, a dropped stream is reopened with backoff,
+        sending Last-Event-ID to resume. Since the bridge may not replay what
+        was missed, a {"type": RESYNC_EVENT_TYPE} change is yielded once the
+        stream is back.
+        """
+        client = await self.get_client()
+        # Events can be minutes apart; only the read timeout is lifted.
+        timeout = httpx.Timeout(connect=self.timeout.connect,
+                                read=None,
+                                write=self.timeout.write,
+                                pool=self.timeout.pool)
+        attempt = 0
+        connected_before = False
+        reconnect_requested = asyncio.Event()
+        self._reconnect_requests.add(reconnect_requested)
+
+        try:
+            while True:
+                # Rebuilt on every attempt, in case connection_info.host
+                # changed.
+                url = ('https://' + self.connection_info.host +
+                       '/eventstream/clip/v2')
+                headers = {
+                    'hue-application-key': self.connection_info.username
+                }
+                if self.last_event_id is not None:
+                    headers['Last-Event-ID'] = self.last_event_id
+
+                try:
+                    async with aconnect_sse(client,
+                                            "GET",
+                                            url,
+                                            headers=headers,
+                                            timeout=timeout) as event_source:
+                        status_code = event_source.response.status_code
+                        if status_code != 200:
+                            raise RequestFailed(status_code, "")
+
+                        attempt = 0
+                        if connected_before:
+                            self.event_stats.resyncs += 1
+                            yield {"type": RESYNC_EVENT_TYPE, "data": []}
+                        connected_before = True
+
+                        async for event in until_set(
+                                event_source.aiter_sse(), reconnect_requested):
+                            if event.id:
+                                self.last_event_id = event.id
+                            if not event.data:
+                                continue
+                            for change in json.loads(event.data):
+                                yield change
+                except (httpx.TransportError, SSEError, RequestFailed) as exc:
+                    if not reconnect or (isinstance(exc, RequestFailed)
+                                         and exc.unexpected_status_code
+                                         in (401, 403)):
+                        raise
+
+                if not reconnect:
+                    return
+
+                self.event_stats.reconnects += 1
+                if not reconnect_requested.is_set():
+                    # A reconnect_events call cuts the backoff short.
+                    try:
+                        await asyncio.wait_for(reconnect_requested.wait(),
+                                               self.reconnect_delay(attempt))
+                    except asyncio.TimeoutError:
+                        attempt += 1
+                reconnect_requested.clear()
+        finally:
+            self._reconnect_requests.discard(reconnect_requested)
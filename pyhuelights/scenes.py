@@ -0,0 +1,139 @@
+""" Contains scene support, to apply many light states with one command. """
+
+import json
+import hashlib
+from copy import deepcopy
+from typing import Any, Dict
+
+from .core import Light, LightsManager
+from .model import Scene
+from .network import construct_body, dict_parser
+from .exceptions import RequestFailed
+
+# Keys of a light state that scenes can store.
+SCENE_STATE_KEYS = {"on", "bri", "xy", "ct", "hue", "sat", "effect"}
+
+
+async def scene_light_state(light: Light, effect: Any) -> Dict[str, Any]:
+    """
+    Returns the state the effect would finally send to the light. The effect
+    runs against a copy of the light's model, so the light itself, including
+    any changes still pending on it, is left untouched.
+    """
+    model = deepcopy(light._model)
+    model.reset()
+    body: Dict[str, Any] = {}
+    async for state in effect.update_state(Light(model)):
+        body.update(construct_body(state))
+    return {k: v for k, v in body.items() if k in SCENE_STATE_KEYS}
+
+
+class SceneManager(object):
+    """
+    Stores "looks" (a target state for each of many lights) as bridge scenes,
+    so that applying one is a single group action. Scenes are named after a
+    hash of their content, so an identical look reuses its scene.
+    """
+
+    NAME_PREFIX = "pyhuelights-"
+
+    def __init__(self, manager: LightsManager):
+        self.manager = manager
+        self.scene_ids: Dict[str, str] = {}  # Keyed by content hash.
+
+    async def get_all_scenes(self) -> Dict[str, Scene]:
+        obj = await self.manager.make_request(relative_url="/scenes",
+                                              method="get")
+        return self.manager.parse_response(obj, parser=dict_parser(Scene))
+
+    async def load_cache(self) -> None:
+        """ Picks up scenes created by earlier runs from the bridge. """
+        for scene_id, scene in (await self.get_all_scenes()).items():
+            if scene.name.startswith(self.NAME_PREFIX):
+                self.scene_ids[scene.name[len(self.NAME_PREFIX):]] = scene_id
+
+    @staticmethod
+    def content_hash(light_states: Dict[str, Dict[str, Any]]) -> str:
+        data = json.dumps(light_states, sort_keys=True).encode("utf-8")
+        return hashlib.sha1(data).hexdigest()[:16]
+
+    async def build_light_states(
+            self, look: Dict[Light, Any]) -> Dict[str, Dict[str, Any]]:
+        """ Maps light id to scene state, for a dict of Light -> effect. """
+        return {
+            light._model.id: await scene_light_state(light, effect)
+            for light, effect in look.items()
+        }
+
+    async def save(self,
+                   look: Dict[Light, Any],
+                   scene_id: str | None = None) -> str:
+        """
+        Creates a scene for the look (a dict of Light -> SetLightStateEffect),
+        or reuses the one with identical content. If scene_id is given, that
+        scene is updated instead. Returns the scene id.
+        """
+        light_states = await self.build_light_states(look)
+        digest = self.content_hash(light_states)
+        body = {
+            "name": self.NAME_PREFIX + digest,
+            "lights": list(light_states),
+            "lightstates": light_states,
+        }
+
+        if scene_id is not None:
+            await self.manager.make_request(
+                relative_url=Scene.make_relative_url(scene_id),
+                method="put",
+                body=body)
+        elif digest in self.scene_ids:
+            return self.scene_ids[digest]
+        else:
+            body["recycle"] = True
+            resp = await self.manager.make_request(relative_url="/scenes",
+                                                   method="post",
+                                                   body=body)
+            try:
+                scene_id = resp[0]["success"]["id"]
+            except (IndexError, KeyError, TypeError):
+                raise RequestFailed(200, resp)
+
+        self.forget(scene_id)
+        self.scene_ids[digest] = scene_id
+        return scene_id
+
+    def forget(self, scene_id: str) -> None:
+        """ Drops a scene from the cache, e.g. after the bridge deleted it. """
+        self.scene_ids = {
+            k: v
+            for k, v in self.scene_ids.items() if v != scene_id
+        }
+
+    async def recall(self, scene_id: str, group_id: str = "0") -> Any:
+        """
+        Applies a scene with a single group action. Raises RequestFailed if
+        the bridge reports an error, e.g. because it recycled the scene.
+        """
+        resp = await self.manager.make_update_request(
+            "/groups/" + group_id + "/action", {"scene": scene_id})
+        if isinstance(resp, list) and any(
+                isinstance(x, dict) and "error" in x for x in resp):
+            raise RequestFailed(200, resp)
+        return resp
+
+    async def apply(self, look: Dict[Light, Any], group_id: str = "0") -> str:
+        """
+        Saves the look if needed, then recalls it. Scenes are created with
+        recycle set, so the bridge may have deleted a cached one; in that case
+        it is created again.
+        """
+        scene_id = await self.save(look)
+        try:
+            await self.recall(scene_id, group_id)
+        except RequestFailed as exc:
+            if exc.unexpected_status_code != 200:
+                raise
+            self.forget(scene_id)
+            scene_id = await self.save(look)
+            await self.recall(scene_id, group_id)
+        return scene_id
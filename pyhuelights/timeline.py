@@ -0,0 +1,405 @@
+"""
+Contains a keyframe timeline engine. A timeline is sampled once into compact
+per-light arrays at a fixed frame rate, and can then be replayed cheaply over
+REST (via LightsManager.run_effect) or through an EntertainmentStreamer.
+"""
+
+import math
+import asyncio
+import colorsys
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Callable, Dict, List, Tuple
+
+from .core import Color, Light, RGB, Temperature, HueSat
+from .model import EMPTY
+from .colorutils import rgb_to_xy, temperature_to_xy
+from .animations import FrameClock
+
+
+def ease_in(t: float) -> float:
+    return t * t
+
+
+def ease_out(t: float) -> float:
+    return t * (2.0 - t)
+
+
+def ease_in_out(t: float) -> float:
+    return (1.0 - math.cos(math.pi * t)) / 2.0
+
+
+def step(t: float) -> float:
+    return 1.0 if t >= 1.0 else 0.0
+
+
+# xy of tracks that never set a color; such tracks only control on/off and
+# brightness.
+NO_COLOR = (math.nan, math.nan)
+# D65, streamed for tracks without color.
+WHITE_POINT = (0.3127, 0.3290)
+
+EASINGS: Dict[str, Callable[[float], float]] = {
+    "linear": lambda t: t,
+    "ease_in": ease_in,
+    "ease_out": ease_out,
+    "ease_in_out": ease_in_out,
+    "step": step,
+}
+
+
+def color_to_xy(color: Color) -> Tuple[float, float]:
+    if isinstance(color, RGB):
+        return rgb_to_xy(color.r, color.g, color.b)
+    elif isinstance(color, Temperature):
+        return temperature_to_xy(color.value)
+    elif isinstance(color, HueSat):
+        r, g, b = colorsys.hsv_to_rgb(color.hue / 65535.0,
+                                      color.saturation / 254.0, 1.0)
+        return rgb_to_xy(round(r * 255), round(g * 255), round(b * 255))
+    raise ValueError(f"Unsupported color: {color}")
+
+
+@dataclass(frozen=True)
+class Keyframe:
+    """
+    Target values of a light at `time` seconds. Values left as None hold
+    their previous value. `easing` shapes the approach from the previous
+    keyframe.
+    """
+    time: float
+    color: Color | None = None
+    brightness: int | None = None
+    on: bool | None = None
+    easing: str = "linear"
+
+
+class LightTrack:
+    """ Sampled trajectory of one light: one array entry per frame. """
+
+    def __init__(self):
+        self.on = array("B")
+        self.x = array("f")
+        self.y = array("f")
+        self.brightness = array("B")
+
+    def frame(self, index: int) -> Tuple[bool, float, float, int]:
+        return (bool(self.on[index]), self.x[index], self.y[index],
+                self.brightness[index])
+
+
+def sample_trajectory(func: Callable[[float], Tuple[bool, float, float, int]],
+                      duration: float, rate: float) -> LightTrack:
+    """
+    Samples a continuous trajectory, given as a function of time in seconds
+    returning (on, x, y, brightness), into a LightTrack.
+    """
+    track = LightTrack()
+    for index in range(int(math.floor(duration * rate)) + 1):
+        on, x, y, brightness = func(index / rate)
+        track.on.append(1 if on else 0)
+        track.x.append(x)
+        track.y.append(y)
+        track.brightness.append(max(0, min(254, round(brightness))))
+    return track
+
+
+class CompiledTimeline:
+
+    def __init__(self, rate: float, frame_count: int,
+                 tracks: Dict[str, LightTrack]):
+        self.rate = rate
+        self.frame_count = frame_count
+        self.tracks = tracks
+
+
+class Timeline:
+    """ Keyframes for a set of lights, keyed by light id. """
+
+    def __init__(self):
+        self.keyframes: Dict[str, List[Keyframe]] = {}
+
+    def add(self, light_id: str, *keyframes: Keyframe) -> "Timeline":
+        for keyframe in keyframes:
+            if keyframe.easing not in EASINGS:
+                raise ValueError(f"Unknown easing: {keyframe.easing}")
+        frames = self.keyframes.setdefault(light_id, [])
+        frames.extend(keyframes)
+        frames.sort(key=lambda x: x.time)
+        return self
+
+    @property
+    def duration(self) -> float:
+        return max((x[-1].time for x in self.keyframes.values() if x),
+                   default=0.0)
+
+    def compile(self, rate: float) -> CompiledTimeline:
+        """ Samples every light's trajectory at `rate` frames per second. """
+        frame_count = int(math.floor(self.duration * rate)) + 1
+        tracks = {
+            light_id: self._sample(keyframes, rate, frame_count)
+            for light_id, keyframes in self.keyframes.items()
+        }
+        return CompiledTimeline(rate, frame_count, tracks)
+
+    @staticmethod
+    def _resolve(keyframes: List[Keyframe]) -> List[Tuple[float, ...]]:
+        """
+        Fills in held values: (time, on, x, y, brightness) per keyframe. Color
+        and brightness before their first keyframe take its value; lights
+        start switched on. Tracks without any color get NO_COLOR.
+        """
+        first_color = next((x.color for x in keyframes if x.color), None)
+        x, y = color_to_xy(first_color) if first_color else NO_COLOR
+        brightness = next(
+            (x.brightness for x in keyframes if x.brightness is not None), 254)
+        on = True
+
+        result = []
+        for keyframe in keyframes:
+            if keyframe.color is not None:
+                x, y = color_to_xy(keyframe.color)
+            if keyframe.brightness is not None:
+                brightness = keyframe.brightness
+            if keyframe.on is not None:
+                on = keyframe.on
+            result.append((keyframe.time, on, x, y, brightness))
+        return result
+
+    def _sample(self, keyframes: List[Keyframe], rate: float,
+                frame_count: int) -> LightTrack:
+        resolved = self._resolve(keyframes)
+        times = [x[0] for x in resolved]
+        track = LightTrack()
+        for index in range(frame_count):
+            t = index / rate
+            pos = bisect_right(times, t)
+            if pos == 0:
+                _, on, x, y, brightness = resolved[0]
+            elif pos == len(resolved):
+                _, on, x, y, brightness = resolved[-1]
+            else:
+                t0, on, x0, y0, b0 = resolved[pos - 1]
+                t1, _, x1, y1, b1 = resolved[pos]
+                easing = EASINGS[keyframes[pos].easing]
+                progress = easing((t - t0) / (t1 - t0))
+                x = x0 + (x1 - x0) * progress
+                y = y0 + (y1 - y0) * progress
+                brightness = b0 + (b1 - b0) * progress
+
+            track.on.append(1 if on else 0)
+            track.x.append(x)
+            track.y.append(y)
+            track.brightness.append(max(0, min(254, round(brightness))))
+        return track
+
+
+class TimelineEffect:
+    """
+    Plays a compiled timeline through LightsManager.run_effect. Only values
+    that changed since the previous frame are sent, with a transition time of
+    one frame so that the bridge smooths between them.
+    """
+
+    def __init__(self,
+                 timeline: CompiledTimeline,
+                 clock: FrameClock | None = None):
+        self.timeline = timeline
+        self.clock = clock or FrameClock(timeline.rate)
+
+    async def update_state(self, light: Light) -> AsyncGenerator[Any, None]:
+        track = self.timeline.tracks[light._model.id]
+        state = light._model.state
+        transition_time = max(0, round(10.0 / self.timeline.rate))
+        ticker = self.clock.ticker()
+        first_frame = ticker.frame
+        sent_on = sent_xy = sent_brightness = None
+        # Lights without color or dimming support only get the other fields.
+        has_xy = state.xy is not EMPTY
+        has_brightness = state.brightness is not EMPTY
+        last_frame = self.timeline.frame_count - 1
+        index = 0
+
+        while index <= last_frame:
+            on, x, y, brightness = track.frame(index)
+            if on != sent_on:
+                state.on = sent_on = on
+            # Color and brightness can't be changed while the light is off.
+            if has_xy and on and not math.isnan(x) and (x, y) != sent_xy:
+                state.xy = [x, y]
+                state.color_mode = "xy"
+                sent_xy = (x, y)
+            if has_brightness and on and brightness != sent_brightness:
+                state.brightness = sent_brightness = brightness
+
+            if state.dirty_mask:
+                state.transition_time = transition_time
+                yield state
+                state.commit()
+
+            if index == last_frame:
+                break
+            # Frames the ticker skipped are dropped, but never the last one.
+            index = min(await ticker.tick() - first_frame, last_frame)
+
+
+async def play_stream(timeline: CompiledTimeline,
+                      streamer: Any,
+                      clock: FrameClock | None = None) -> None:
+    """
+    Plays a compiled timeline through an EntertainmentStreamer that uses the
+    xy color space. Light ids must be numeric.
+    """
+    ticker = (clock or FrameClock(timeline.rate)).ticker()
+    first_frame = ticker.frame
+    last_frame = timeline.frame_count - 1
+    index = 0
+    while index <= last_frame:
+        for light_id, track in timeline.tracks.items():
+            on, x, y, brightness = track.frame(index)
+            if math.isnan(x):
+                x, y = WHITE_POINT
+            streamer.set_color(int(light_id),
+                               (x, y, brightness / 254.0 if on else 0.0))
+        if index == last_frame:
+            break
+        index = min(await ticker.tick() - first_frame, last_frame)
+
+
+@dataclass(frozen=True)
+class PlannedCommand:
+    """ At `time` seconds, ask the bridge to fade to the given values. """
+    time: float
+    on: bool
+    xy: Tuple[float, float]
+    brightness: int
+    transition_time: int  # In units of 100ms, like LightState's.
+
+
+def plan_commands(track: LightTrack,
+                  rate: float,
+                  xy_tolerance: float = 0.005,
+                  brightness_tolerance: int = 2) -> List[PlannedCommand]:
+    """
+    Approximates a sampled trajectory with as few bridge commands as
+    possible. Each command lets the bridge fade linearly to a later sample;
+    a segment is extended for as long as that fade stays within the given
+    tolerances of every sample it covers.
+    """
+    count = len(track.on)
+    if count == 0:
+        return []
+
+    channels = ((track.x, xy_tolerance), (track.y, xy_tolerance),
+                (track.brightness, brightness_tolerance))
+
+    def extend(start: int) -> int:
+        """
+        Returns the furthest end such that a fade from start to it stays
+        within tolerance. Every sample k the fade passes bounds its slope to
+        [(v[k] - tol - v[start]) / (k - start), (v[k] + tol - v[start]) /
+        (k - start)], so each channel keeps the intersection of those bounds
+        and a candidate end is checked in constant time. Any shorter end is
+        within tolerance as well.
+        """
+        bounds = [[-math.inf, math.inf] for _ in channels]
+        end = start + 1
+        # Switching on/off can't be faded, so it always ends a segment.
+        while (end + 1 < count and track.on[end + 1] == track.on[start]
+               and track.on[end] == track.on[start]):
+            span = end - start
+            for (values, tolerance), bound in zip(channels, bounds):
+                # end becomes a sample that the candidate fade passes.
+                delta = values[end] - values[start]
+                # Written so that NaN (NO_COLOR) never narrows the bounds.
+                if (delta - tolerance) / span > bound[0]:
+                    bound[0] = (delta - tolerance) / span
+                if (delta + tolerance) / span < bound[1]:
+                    bound[1] = (delta + tolerance) / span
+                slope = (values[end + 1] - values[start]) / (span + 1)
+                if slope < bound[0] or slope > bound[1]:
+                    return end
+            end += 1
+        return end
+
+    def deciseconds(frame: int) -> int:
+        return round(frame * 10.0 / rate)
+
+    def on_grid(frame: int) -> bool:
+        return abs(frame * 10.0 / rate - deciseconds(frame)) < 1e-6
+
+    def command(start: int, end: int) -> PlannedCommand:
+        # Times are rounded to the bridge's 100ms resolution, in a way that
+        # does not accumulate drift across segments.
+        on, x, y, brightness = track.frame(end)
+        return PlannedCommand(time=deciseconds(start) / 10.0,
+                              on=on,
+                              xy=(x, y),
+                              brightness=brightness,
+                              transition_time=deciseconds(end) -
+                              deciseconds(start))
+
+    commands = [command(0, 0)]
+    start = 0
+    while start < count - 1:
+        end = extend(start)
+        # Prefer ending on the bridge's 100ms grid, so that the fade lasts
+        # exactly as long as the segment.
+        aligned = end
+        while end < count - 1 and aligned > start + 1 and not on_grid(aligned):
+            aligned -= 1
+        if on_grid(aligned):
+            end = aligned
+        commands.append(command(start, end))
+        start = end
+    return commands
+
+
+class PlannedEffect:
+    """
+    Plays a sampled trajectory (or a compiled timeline's tracks) as planned
+    commands, relying on the bridge's transitions instead of sending every
+    frame.
+    """
+
+    def __init__(self,
+                 tracks: Dict[str, LightTrack],
+                 rate: float,
+                 xy_tolerance: float = 0.005,
+                 brightness_tolerance: int = 2):
+        self.commands = {
+            light_id: plan_commands(track, rate, xy_tolerance,
+                                    brightness_tolerance)
+            for light_id, track in tracks.items()
+        }
+
+    @classmethod
+    def from_timeline(cls, timeline: CompiledTimeline,
+                      **kwargs: Any) -> "PlannedEffect":
+        return cls(timeline.tracks, timeline.rate, **kwargs)
+
+    async def update_state(self, light: Light) -> AsyncGenerator[Any, None]:
+        loop = asyncio.get_running_loop()
+        state = light._model.state
+        has_xy = state.xy is not EMPTY
+        has_brightness = state.brightness is not EMPTY
+        started = loop.time()
+        for command in self.commands[light._model.id]:
+            delay = started + command.time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if state.on != command.on:
+                state.on = command.on
+            if command.on:
+                if (has_xy and not math.isnan(command.xy[0])
+                        and state.xy != list(command.xy)):
+                    state.xy = list(command.xy)
+                    state.color_mode = "xy"
+                if has_brightness and state.brightness != command.brightness:
+                    state.brightness = command.brightness
+            if state.dirty_mask:
+                state.transition_time = command.transition_time
+                yield state
+                state.commit()
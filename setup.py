@@ -16,6 +16,9 @@ setup(
         "zeroconf",
         "httpx-sse",
     ],
+    extras_require={
+        "numpy": ["numpy"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3.10",
         "Programming Language :: Python :: 3.11",
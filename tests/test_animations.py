@@ -1,6 +1,9 @@
+import time
+import asyncio
+
 import pytest
 
-from pyhuelights.animations import linear_transition
+from pyhuelights.animations import linear_transition, FrameClock
 
 
 class TestLinearTransition(object):
@@ -25,3 +28,49 @@ class TestLinearTransition(object):
         expected = [[3, 4, 6], [5, 6, 8], [7, 8, 10], [9, 10, 12]]
 
         assert all(y == pytest.approx(x) for x, y in zip(res, expected))
+
+
+class TestFrameClock(object):
+
+    @pytest.mark.asyncio
+    async def test_shared_ticks(self):
+        clock = FrameClock(50)
+        tickers = [clock.ticker() for _ in range(3)]
+
+        frames = await asyncio.gather(*(x.tick() for x in tickers))
+
+        assert len(set(frames)) == 1
+        assert not clock._waiters
+
+    @pytest.mark.asyncio
+    async def test_compensates_for_work(self):
+        clock = FrameClock(20)
+        ticker = clock.ticker()
+        await ticker.tick()
+
+        started = time.monotonic()
+        for _ in range(4):
+            await asyncio.sleep(0.02)  # Less than a frame of work.
+            await ticker.tick()
+
+        assert time.monotonic() - started == pytest.approx(0.2, abs=0.04)
+        assert ticker.dropped_frames == 0
+
+    @pytest.mark.asyncio
+    async def test_drops_frames_when_behind(self):
+        clock = FrameClock(50)
+        ticker = clock.ticker()
+        first = await ticker.tick()
+
+        await asyncio.sleep(0.1)  # ~5 frames.
+        started = time.monotonic()
+        frame = await ticker.tick()
+
+        assert time.monotonic() - started < 0.01
+        assert frame - first >= 4
+        assert ticker.dropped_frames == frame - first - 1
+        assert clock.dropped_frames == ticker.dropped_frames
+
+    def test_invalid_rate(self):
+        with pytest.raises(ValueError):
+            FrameClock(0)
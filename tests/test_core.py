@@ -1,8 +1,27 @@
+import json
+import asyncio
+import time
+import random
+from copy import deepcopy
+
 import pytest
-from pyhuelights.core import Light, Temperature, HueSat, RGB
+import respx
+from httpx import Response
+
+from pyhuelights.core import Light, LightsManager, Temperature, HueSat, RGB
+from pyhuelights.core import plan_group_commands
+from pyhuelights import colorutils
 from pyhuelights.colorutils import rgb_to_xy, xy_to_rgb
-from pyhuelights.model import Light as LightRaw, update_from_object
-from pyhuelights.animations import SetLightStateEffect
+from pyhuelights.colorutils import rgb_to_xy_batch, xy_to_rgb_batch
+from pyhuelights.model import Light as LightRaw, Group, update_from_object
+from pyhuelights.model import patch_from_object
+from pyhuelights.model import LightState
+from pyhuelights.animations import SetLightStateEffect, ColorLoopEffect
+from pyhuelights.exceptions import RequestFailed
+from pyhuelights.registration import AuthenticatedHueConnection
+from pyhuelights.network import BaseResourceManager
+
+from utils import LIGHT_JSON, make_light
 
 
 @pytest.mark.asyncio
@@ -125,6 +144,130 @@ def test_rgb_to_xy_to_rgb():
         assert b2 == pytest.approx(b, abs=20)
 
 
+BATCH_COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 255),
+                (0, 0, 0), (10, 10, 10), (255, 165, 0), (75, 0, 130)]
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_batch_conversion_matches_scalar(monkeypatch, use_numpy):
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(colorutils, "np", None)
+
+    xy = rgb_to_xy_batch(BATCH_COLORS)
+    expected_xy = [rgb_to_xy(*x) for x in BATCH_COLORS]
+    assert len(xy) == len(BATCH_COLORS)
+    for actual, expected in zip(xy, expected_xy):
+        assert tuple(actual) == pytest.approx(expected)
+
+    bri = [255, 128, 0, 255, 10, 255, 200, 100]
+    rgb = xy_to_rgb_batch(expected_xy, bri)
+    expected_rgb = [xy_to_rgb(x, y, b) for (x, y), b in zip(expected_xy, bri)]
+    assert [tuple(int(c) for c in x) for x in rgb] == expected_rgb
+
+    rgb = xy_to_rgb_batch(expected_xy)
+    assert [tuple(int(c) for c in x) for x in rgb
+            ] == [xy_to_rgb(x, y) for x, y in expected_xy]
+
+
+def test_batch_conversion_rejects_out_of_range():
+    pytest.importorskip("numpy")
+
+    for rgb in ([[-1, 0, 0]], [[0, 256, 0]]):
+        with pytest.raises(ValueError):
+            rgb_to_xy_batch(rgb)
+
+
+def test_batch_xy_quantized_like_scalar():
+    pytest.importorskip("numpy")
+    random.seed(1)
+    xy = [(random.uniform(0.01, 0.7), random.uniform(0.01, 0.8))
+          for _ in range(2000)]
+    bri = [random.randint(0, 255) for _ in xy]
+
+    rgb = xy_to_rgb_batch(xy, bri)
+
+    assert [tuple(int(c) for c in x) for x in rgb
+            ] == [xy_to_rgb(x, y, b) for (x, y), b in zip(xy, bri)]
+
+
+def test_conversion_cache():
+    colorutils.clear_caches()
+
+    assert rgb_to_xy(255, 165, 0) == rgb_to_xy(255, 165, 0)
+    assert xy_to_rgb(0.31271, 0.329, 200) == xy_to_rgb(0.31272, 0.329, 200)
+
+    stats = colorutils.cache_stats()
+    assert (stats["rgb_to_xy"].hits, stats["rgb_to_xy"].misses) == (1, 1)
+    assert (stats["xy_to_rgb"].hits, stats["xy_to_rgb"].misses) == (1, 1)
+    assert stats["rgb_to_xy"].maxsize == colorutils.CACHE_SIZE
+
+
+def test_linearize_table():
+    for i in (0, 10, 11, 128, 255):
+        assert colorutils.LINEARIZE_TABLE[i] == pytest.approx(
+            colorutils.linearize(i / 255.0))
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_gamut_clip(monkeypatch, use_numpy):
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(colorutils, "np", None)
+    gamut = colorutils.GAMUTS["B"]
+
+    # Inside points are unchanged.
+    assert gamut.contains(0.4, 0.3)
+    assert gamut.clip(0.4, 0.3) == (0.4, 0.3)
+    # Beyond a vertex, clip to the vertex.
+    assert gamut.clip(0.8, 0.3) == pytest.approx((0.675, 0.322))
+    # Beyond an edge, clip onto it.
+    x, y = gamut.clip(0.3, 0.0)
+    assert not gamut.contains(0.3, 0.0)
+    assert gamut.clip(x, y) == pytest.approx((x, y))
+
+    points = [(0.4, 0.3), (0.8, 0.3), (0.3, 0.0), (0.0, 0.9)]
+    clipped = gamut.clip_batch(points)
+    for actual, (x, y) in zip(clipped, points):
+        assert tuple(actual) == pytest.approx(gamut.clip(x, y))
+
+    rgb = [(0, 0, 255), (0, 255, 0), (30, 30, 30)]
+    for actual, color in zip(rgb_to_xy_batch(rgb, gamut), rgb):
+        assert tuple(actual) == pytest.approx(rgb_to_xy(*color, gamut))
+
+
+def test_gamut_for():
+    assert colorutils.gamut_for({"colorgamuttype": "A"}) is colorutils.GAMUTS["A"]
+    assert colorutils.gamut_for({
+        "colorgamuttype": "other",
+        "colorgamut": [[0.6915, 0.3083], [0.17, 0.7], [0.1532, 0.0475]]
+    }) is colorutils.GAMUTS["C"]
+    custom = colorutils.gamut_for(
+        {"colorgamut": [[0.6, 0.3], [0.2, 0.6], [0.2, 0.1]]})
+    assert custom.points == ((0.6, 0.3), (0.2, 0.6), (0.2, 0.1))
+    assert colorutils.gamut_for({}) is None
+
+
+@pytest.mark.asyncio
+async def test_set_light_state_clips_to_gamut():
+    light_model = LightRaw()
+    data = deepcopy(LIGHT_JSON)
+    data["state"]["xy"] = [0.3, 0.3]
+    data["capabilities"]["control"] = {"colorgamuttype": "A"}
+    update_from_object(light_model, "1", data)
+    light = Light(light_model)
+
+    async for _ in SetLightStateEffect(on=True,
+                                       color=RGB(0, 0, 255)).update_state(light):
+        pass
+
+    x, y = light_model.state.xy
+    assert (x, y) != pytest.approx(rgb_to_xy(0, 0, 255))
+    assert (x, y) == pytest.approx(rgb_to_xy(0, 0, 255, light.gamut))
+
+
 def test_xy_to_rgb_boundaries():
     # Test boundary cases.
     assert xy_to_rgb(0.0, 0.0) == (0, 0, 0)
@@ -155,3 +298,398 @@ def test_validation():
         RGB(-1, 0, 0)
     with pytest.raises(ValueError):
         RGB(256, 0, 0)
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_get_all_lights_lazy():
+    data = deepcopy(LIGHT_JSON)
+    data["name"] = "Kitchen"
+    respx.get("http://host/api/user/lights").mock(
+        return_value=Response(200, json={"1": data}))
+    manager = LightsManager(AuthenticatedHueConnection("host", "user"))
+
+    lights = await manager.get_all_lights(lazy=True)
+
+    light = lights["1"]
+    assert light._light_model is None
+    assert light.raw_json == data
+    assert light.metadata.name == "Kitchen"
+    assert isinstance(light._model.values[LightRaw.field_index["state"]],
+                      dict)
+    assert light.reachable is True
+    assert isinstance(light._model.values[LightRaw.field_index["state"]],
+                      LightState)
+
+
+class TestRunEffect:
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_concurrent_collects_errors(self):
+        respx.put("http://host/api/user/lights/1/state").mock(
+            return_value=Response(200, json=[]))
+        respx.put("http://host/api/user/lights/2/state").mock(
+            return_value=Response(500))
+        respx.put("http://host/api/user/lights/3/state").mock(
+            return_value=Response(200, json=[]))
+
+        manager = LightsManager(AuthenticatedHueConnection("host", "user"))
+        lights = [make_light(x) for x in ("1", "2", "3")]
+
+        summary = await manager.run_effect(lights,
+                                           SetLightStateEffect(on=True),
+                                           concurrent=True,
+                                           max_concurrency=2)
+
+        assert [x.light for x in summary.results] == lights
+        assert [x.light for x in summary.failed] == [lights[1]]
+        assert isinstance(summary.failed[0].error, RequestFailed)
+        assert len(summary.succeeded) == 2
+        assert all(x.latency >= 0 for x in summary.results)
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_concurrent_runs_lights_in_parallel(self):
+        respx.put(url__regex=r"http://host/api/user/lights/\d/state").mock(
+            return_value=Response(200, json=[]))
+
+        manager = LightsManager(AuthenticatedHueConnection("host", "user"))
+        lights = [make_light(str(x)) for x in range(5)]
+
+        started = time.monotonic()
+        summary = await manager.run_effect(lights,
+                                           ColorLoopEffect(transition_time=0.2),
+                                           concurrent=True)
+
+        assert time.monotonic() - started < 0.5
+        assert not summary.failed
+
+    @pytest.mark.asyncio
+    async def test_concurrent_failure_cancels_others(self):
+        cancelled = []
+
+        class Effect:
+
+            async def update_state(self, light):
+                if light._model.id == "1":
+                    raise ValueError("broken effect")
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.append(light._model.id)
+                    raise
+                yield light._model.state
+
+        manager = LightsManager(AuthenticatedHueConnection("host", "user"))
+        lights = [make_light(x) for x in ("1", "2", "3")]
+
+        with pytest.raises(ValueError):
+            await manager.run_effect(lights, Effect(), concurrent=True)
+
+        assert sorted(cancelled) == ["2", "3"]
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_sequential_raises(self):
+        respx.put("http://host/api/user/lights/1/state").mock(
+            return_value=Response(500))
+
+        manager = LightsManager(AuthenticatedHueConnection("host", "user"))
+
+        with pytest.raises(RequestFailed):
+            await manager.run_effect(make_light("1"),
+                                     SetLightStateEffect(on=True))
+
+
+def fake_events(changes):
+
+    async def iter_events(self, reconnect=False):
+        for change in changes:
+            yield change
+
+    return iter_events
+
+
+class TestIterEvents:
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_patch_known_lights(self, monkeypatch):
+        monkeypatch.setattr(
+            BaseResourceManager, "iter_events",
+            fake_events([{
+                "type": "update",
+                "data": [{
+                    "id_v1": "/lights/1",
+                    "type": "light",
+                    "on": {
+                        "on": True
+                    },
+                    "dimming": {
+                        "brightness": 50.0
+                    },
+                    "color": {
+                        "xy": {
+                            "x": 0.2,
+                            "y": 0.3
+                        }
+                    }
+                }, {
+                    "id_v1": "/lights/2",
+                    "type": "zigbee_connectivity",
+                    "status": "connectivity_issue"
+                }, {
+                    "id_v1": "/lights/1",
+                    "type": "light",
+                    "color_temperature": {
+                        "mirek": 500,
+                        "mirek_valid": True
+                    }
+                }, {
+                    "id_v1": "/groups/1",
+                    "type": "grouped_light",
+                    "on": {
+                        "on": True
+                    }
+                }]
+            }]))
+
+        manager = LightsManager(AuthenticatedHueConnection("host", "user"))
+        lights = {"1": make_light("1"), "2": make_light("2")}
+
+        res = [x async for x in manager.iter_events(lights)]
+
+        assert res == [lights["1"], lights["2"], lights["1"]]
+        state = lights["1"]._model.state
+        assert state.on is True
+        assert state.brightness == 127
+        assert state.xy == [0.2, 0.3]
+        assert state.color_mode == "ct"
+        assert state.temperature == 2000
+        assert not any(state.dirty_flag.values())
+        assert lights["2"].reachable is False
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_unknown_light_fetched(self, monkeypatch):
+        monkeypatch.setattr(
+            BaseResourceManager, "iter_events",
+            fake_events([{
+                "type": "add",
+                "data": [{
+                    "id_v1": "/lights/3",
+                    "type": "light"
+                }]
+            }, {
+                "type": "delete",
+                "data": [{
+                    "id_v1": "/lights/1",
+                    "type": "light"
+                }]
+            }]))
+        route = respx.get("http://host/api/user/lights/3").mock(
+            return_value=Response(200, json=LIGHT_JSON))
+
+        manager = LightsManager(AuthenticatedHueConnection("host", "user"))
+        lights = {"1": make_light("1")}
+
+        res = [x async for x in manager.iter_events(lights)]
+
+        assert route.call_count == 1
+        assert list(lights) == ["3"]
+        assert res == [lights["3"]]
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_resync(self, monkeypatch):
+        monkeypatch.setattr(BaseResourceManager, "iter_events",
+                            fake_events([{
+                                "type": "resync",
+                                "data": []
+                            }]))
+        fresh = deepcopy(LIGHT_JSON)
+        fresh["state"]["on"] = True
+        route = respx.get("http://host/api/user/lights").mock(
+            return_value=Response(200, json={"1": fresh, "3": fresh}))
+
+        manager = LightsManager(AuthenticatedHueConnection("host", "user"))
+        light1 = make_light("1")
+        lights = {"1": light1, "2": make_light("2")}
+
+        res = [x async for x in manager.iter_events(lights, reconnect=True)]
+
+        assert route.call_count == 1
+        assert sorted(lights) == ["1", "3"]
+        assert lights["1"] is light1
+        assert light1.on is True
+        assert res == [lights["1"], lights["3"]]
+
+
+def make_group(group_id, light_ids):
+    group = Group()
+    update_from_object(
+        group, group_id, {
+            "name": "Group " + group_id,
+            "lights": light_ids,
+            "type": "LightGroup",
+            "action": {
+                "on": False,
+                "colormode": "ct"
+            }
+        })
+    return group
+
+
+class TestGroupCommands:
+
+    def test_plan(self):
+        groups = {
+            "1": make_group("1", ["1", "2"]),
+            "2": make_group("2", ["1", "2", "3", "4"]),
+            "3": make_group("3", ["3", "5"]),
+        }
+        on, off = {"on": True}, {"on": False}
+        bodies = {"1": on, "2": on, "3": on, "4": on, "5": off, "6": on}
+
+        commands, remaining = plan_group_commands(bodies, groups)
+
+        assert commands == [("2", on)]
+        assert sorted(remaining) == ["5", "6"]
+
+    def test_plan_divergent(self):
+        groups = {"1": make_group("1", ["1", "2"])}
+        commands, remaining = plan_group_commands(
+            {
+                "1": {
+                    "on": True
+                },
+                "2": {
+                    "on": False
+                }
+            }, groups)
+
+        assert commands == []
+        assert sorted(remaining) == ["1", "2"]
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_run_effect_with_groups(self):
+        group_route = respx.put("http://host/api/user/groups/1/action").mock(
+            return_value=Response(
+                200, json=[{"success": {"/groups/1/action/on": True}}]))
+        light_route = respx.put("http://host/api/user/lights/3/state").mock(
+            return_value=Response(200, json=[]))
+
+        manager = LightsManager(AuthenticatedHueConnection("host", "user"))
+        lights = [make_light(x) for x in ("1", "2", "3")]
+        groups = {"1": make_group("1", ["1", "2"])}
+
+        summary = await manager.run_effect(lights,
+                                           SetLightStateEffect(on=True),
+                                           groups=groups)
+
+        assert group_route.call_count == 1
+        assert json.loads(group_route.calls.last.request.content) == {
+            "on": True
+        }
+        assert light_route.call_count == 1
+        assert len(summary.succeeded) == 3
+        # Only the group's acknowledged fields are committed.
+        state = lights[0]._model.state
+        assert not state.is_dirty("on")
+        assert state.orig_values[state.field_index["on"]] is True
+        assert lights[2]._model.state.is_dirty("on")
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_grouped_skip_unchanged_plans_on_targets(self):
+        group_route = respx.put("http://host/api/user/groups/1/action").mock(
+            return_value=Response(200, json=[]))
+
+        manager = LightsManager(AuthenticatedHueConnection("host", "user"),
+                                skip_unchanged=True)
+        lights = [make_light(x) for x in ("1", "2")]
+        patch_from_object(lights[0]._model.state, {"on": True})
+        groups = {"1": make_group("1", ["1", "2"])}
+
+        await manager.run_effect(lights,
+                                 SetLightStateEffect(on=True),
+                                 groups=groups)
+
+        # Light 1 is already on, but still matches the group's target.
+        assert group_route.call_count == 1
+        assert json.loads(group_route.calls.last.request.content) == {
+            "on": True
+        }
+
+        patch_from_object(lights[1]._model.state, {"on": True})
+        await manager.run_effect(lights,
+                                 SetLightStateEffect(on=True),
+                                 groups=groups)
+
+        assert group_route.call_count == 1
+        assert manager.suppressed_writes == 2
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_grouped_concurrent_collects_errors(self):
+        respx.put("http://host/api/user/groups/1/action").mock(
+            return_value=Response(200, json=[]))
+        respx.put("http://host/api/user/lights/3/state").mock(
+            return_value=Response(500))
+        closed = []
+
+        class TwoStepEffect:
+
+            async def update_state(self, light):
+                try:
+                    light._model.state.on = True
+                    yield light._model.state
+                    light._model.state.on = False
+                    yield light._model.state
+                finally:
+                    closed.append(light._model.id)
+
+        manager = LightsManager(AuthenticatedHueConnection("host", "user"))
+        lights = [make_light(x) for x in ("1", "2", "3")]
+        groups = {"1": make_group("1", ["1", "2"])}
+
+        summary = await manager.run_effect(lights,
+                                           TwoStepEffect(),
+                                           concurrent=True,
+                                           max_concurrency=1,
+                                           groups=groups)
+
+        assert [x.light._model.id for x in summary.failed] == ["3"]
+        assert isinstance(summary.failed[0].error, RequestFailed)
+        assert len(summary.succeeded) == 2
+        assert summary.failed[0].latency < summary.succeeded[0].latency
+        assert sorted(closed) == ["1", "2", "3"]
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_grouped_sequential_raises_and_closes(self):
+        respx.put("http://host/api/user/groups/1/action").mock(
+            return_value=Response(500))
+        closed = []
+
+        class ClosingEffect(SetLightStateEffect):
+
+            async def update_state(self, light):
+                try:
+                    async for state in super().update_state(light):
+                        yield state
+                        yield state
+                finally:
+                    closed.append(light._model.id)
+
+        manager = LightsManager(AuthenticatedHueConnection("host", "user"))
+        lights = [make_light(x) for x in ("1", "2")]
+        groups = {"1": make_group("1", ["1", "2"])}
+
+        with pytest.raises(RequestFailed):
+            await manager.run_effect(lights,
+                                     ClosingEffect(on=True),
+                                     groups=groups)
+        assert sorted(closed) == ["1", "2"]
@@ -1,8 +1,21 @@
+import time
+import socket
+import asyncio
+
+import httpx
 import pytest
 import respx
 from httpx import Response
 
 from pyhuelights.discovery import NUPNPDiscovery, StaticHostDiscovery
+from pyhuelights.discovery import DefaultDiscovery, CachedDiscovery
+from pyhuelights.discovery import DiscoveryCache
+from pyhuelights.discovery import UnauthenticatedHueRawConnectionInfo
+from pyhuelights.discovery import BridgeWatcher, mdns_bridge_id
+from pyhuelights.discovery import BridgeDescription
+from pyhuelights.core import LightsManager
+from pyhuelights.network import BaseResourceManager
+from pyhuelights.registration import AuthenticatedHueConnection
 from pyhuelights.exceptions import DiscoveryFailed
 
 
@@ -85,3 +98,372 @@ class TestStaticHostDiscovery(object):
     @pytest.mark.asyncio
     async def test_discover_host(self):
         assert "philips-hue" == await StaticHostDiscovery().discover_host()
+
+
+def fake_method(delay, host=None, cleanups=None):
+
+    class FakeDiscovery(object):
+
+        def __init__(self, client=None):
+            pass
+
+        async def discover(self):
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                if cleanups is not None:
+                    cleanups.append(delay)
+            if host is None:
+                raise DiscoveryFailed
+            return host
+
+    return FakeDiscovery
+
+
+class TestDefaultDiscovery(object):
+
+    @pytest.mark.asyncio
+    async def test_sequential(self):
+        discovery = DefaultDiscovery()
+        discovery.METHODS = [fake_method(0.01), fake_method(0.01, "b")]
+        discovery.METHODS[0].__name__ = "A"
+        discovery.METHODS[1].__name__ = "B"
+
+        assert await discovery.discover() == "b"
+        assert discovery.last_report.winner == "B"
+        assert discovery.last_report.outcomes == {"A": "failed", "B": "won"}
+
+    @pytest.mark.asyncio
+    async def test_race_first_validated_wins(self):
+        cleanups = []
+        discovery = DefaultDiscovery(race=True)
+        discovery.METHODS = [
+            fake_method(5.0, "slow", cleanups),
+            fake_method(0.01),
+            fake_method(0.05, "fast"),
+        ]
+        for cls, name in zip(discovery.METHODS, ["Slow", "Failing", "Fast"]):
+            cls.__name__ = name
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        assert await discovery.discover() == "fast"
+
+        assert loop.time() - started < 1.0
+        assert cleanups == [5.0]
+        report = discovery.last_report
+        assert report.winner == "Fast"
+        assert report.outcomes == {
+            "Failing": "failed",
+            "Fast": "won",
+            "Slow": "cancelled"
+        }
+        assert report.durations["Failing"] < report.durations["Fast"]
+
+    @pytest.mark.asyncio
+    async def test_race_all_failed(self):
+        discovery = DefaultDiscovery(race=True)
+        discovery.METHODS = [fake_method(0.01), fake_method(0.02)]
+
+        with pytest.raises(DiscoveryFailed):
+            await discovery.discover()
+        assert discovery.last_report.winner is None
+
+
+def description_xml(serial):
+    return ('<?xml version="1.0" encoding="UTF-8" ?>'
+            '<root xmlns="urn:schemas-upnp-org:device-1-0"><device>'
+            '<manufacturer>Royal Philips Electronics</manufacturer>'
+            f'<serialNumber>{serial}</serialNumber>'
+            '</device></root>')
+
+
+def fake_hosts_method(*hosts, delay=0.0):
+
+    class FakeDiscovery(object):
+
+        def __init__(self, client=None):
+            pass
+
+        async def discover_hosts(self, timeout=None):
+            for host in hosts:
+                await asyncio.sleep(delay)
+                yield host
+
+    return FakeDiscovery
+
+
+class TestSharedClient(object):
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_methods_share_one_client(self, monkeypatch):
+        respx.get("http://philips-hue/description.xml").mock(
+            return_value=Response(200, text=BRIDGE_DESCRIPTION))
+        respx.get(NUPNPDiscovery.NUPNP_URL).mock(
+            return_value=Response(200, json=[{
+                "internalipaddress": "philips-hue"
+            }]))
+        clients = []
+        original = UnauthenticatedHueRawConnectionInfo.validate
+
+        async def validate(self, timeout=5.0, client=None):
+            clients.append(client)
+            return await original(self, timeout, client)
+
+        monkeypatch.setattr(UnauthenticatedHueRawConnectionInfo, "validate",
+                            validate)
+
+        for race in (False, True):
+            discovery = DefaultDiscovery(race=race)
+            discovery.METHODS = [StaticHostDiscovery, NUPNPDiscovery]
+            result = await discovery.discover()
+            assert result.bridge_id == "0017884a2b3c"
+
+        assert clients and all(x is not None for x in clients)
+        assert len(set(map(id, clients))) == 2
+
+
+class TestDiscoverAll(object):
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_all_bridges_deduplicated(self):
+        for host, serial in [("a", "001"), ("b", "002"), ("c", "001")]:
+            respx.get(f"http://{host}/description.xml").mock(
+                return_value=Response(200, text=description_xml(serial)))
+        respx.get("http://d/description.xml").mock(
+            return_value=Response(200, text="Not a bridge"))
+
+        discovery = DefaultDiscovery()
+        discovery.METHODS = [
+            fake_hosts_method("a", "d"),
+            fake_hosts_method("a", "b", "c", delay=0.01)
+        ]
+
+        bridges = [x async for x in discovery.discover_all(window=1.0)]
+
+        assert sorted((x.host, x.bridge_id) for x in bridges) == [("a", "001"),
+                                                                 ("b", "002")]
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_first_bridge_before_window_ends(self):
+        respx.get("http://a/description.xml").mock(
+            return_value=Response(200, text=description_xml("001")))
+        discovery = DefaultDiscovery()
+        discovery.METHODS = [
+            fake_hosts_method("b", delay=10.0),
+            fake_hosts_method("a")
+        ]
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        bridges = discovery.discover_all(window=30.0)
+        first = await anext(bridges)
+        await bridges.aclose()
+
+        assert first.bridge_id == "001"
+        assert loop.time() - started < 1.0
+
+
+class TestCachedDiscovery(object):
+
+    def make_fallback(self, host):
+
+        class Fallback(object):
+            calls = 0
+
+            async def discover(self):
+                Fallback.calls += 1
+                connection_info = UnauthenticatedHueRawConnectionInfo(host)
+                await connection_info.validate()
+                return connection_info
+
+        return Fallback()
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_cache_hit_skips_discovery(self, tmp_path):
+        respx.get("http://a/description.xml").mock(
+            return_value=Response(200, text=description_xml("001")))
+        path = str(tmp_path / "bridges.json")
+        fallback = self.make_fallback("a")
+
+        first = await CachedDiscovery(DiscoveryCache(path), fallback).discover()
+        second = await CachedDiscovery(DiscoveryCache(path),
+                                       fallback).discover()
+
+        assert (first.host, second.host) == ("a", "a")
+        assert second.bridge_id == "001"
+        assert fallback.calls == 1
+        assert DiscoveryCache(path).entries["001"]["host"] == "a"
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_moved_bridge_falls_back(self, tmp_path):
+        respx.get("http://a/description.xml").mock(
+            side_effect=httpx.ConnectError("unreachable"))
+        respx.get("http://b/description.xml").mock(
+            return_value=Response(200, text=description_xml("001")))
+        cache = DiscoveryCache(str(tmp_path / "bridges.json"))
+        cache.entries = {"001": {"host": "a", "validated_at": time.time()}}
+        fallback = self.make_fallback("b")
+
+        result = await CachedDiscovery(cache, fallback).discover()
+
+        assert result.host == "b"
+        assert fallback.calls == 1
+        assert cache.entries["001"]["host"] == "b"
+
+    def test_stale_and_corrupt_entries(self, tmp_path):
+        path = tmp_path / "bridges.json"
+        path.write_text("not json")
+        cache = DiscoveryCache(str(path))
+        assert cache.entries == {}
+
+        cache.entries = {
+            "old": {
+                "host": "a",
+                "validated_at": time.time() - 100
+            },
+            "new": {
+                "host": "b",
+                "validated_at": time.time()
+            }
+        }
+        assert cache.recent(1000) == [("new", "b"), ("old", "a")]
+        assert cache.recent(10) == [("new", "b")]
+
+
+class FakeServiceInfo(object):
+
+    def __init__(self, name, address, bridge_id):
+        self.name = name
+        self.addresses = [socket.inet_aton(address)]
+        self.properties = {b"bridgeid": bridge_id.encode("ascii")}
+
+
+class TestBridgeWatcher(object):
+
+    def test_mdns_bridge_id(self):
+        info = FakeServiceInfo("hue", "10.0.0.2", "001788FFFE4A2B3C")
+        assert mdns_bridge_id(info) == "0017884a2b3c"
+
+    def test_tracks_address_changes(self):
+        watcher = BridgeWatcher()
+        manager = LightsManager(AuthenticatedHueConnection("10.0.0.2", "u"))
+        other = LightsManager(AuthenticatedHueConnection("10.0.0.9", "u"))
+        watcher.attach("0017884a2b3c", manager)
+        watcher.attach("0017884a2b3d", other)
+
+        watcher.service_changed(
+            FakeServiceInfo("hue", "10.0.0.2", "001788FFFE4A2B3C"))
+        watcher.service_changed(
+            FakeServiceInfo("hue", "10.0.0.7", "001788FFFE4A2B3C"))
+
+        assert manager.connection_info.host == "10.0.0.7"
+        assert other.connection_info.host == "10.0.0.9"
+        assert watcher.addresses == {"0017884a2b3c": "10.0.0.7"}
+        assert watcher.online == {"0017884a2b3c"}
+
+        watcher.service_removed("hue")
+        assert watcher.online == set()
+        assert watcher.addresses == {"0017884a2b3c": "10.0.0.7"}
+
+        late = LightsManager(AuthenticatedHueConnection("10.0.0.2", "u"))
+        watcher.attach("0017884a2b3c", late)
+        assert late.connection_info.host == "10.0.0.7"
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_moves_connected_event_stream(self):
+
+        class OpenStream(httpx.AsyncByteStream):
+            """ Sends one event, then stays open like a quiet bridge. """
+
+            async def __aiter__(self):
+                yield b'id: 1:0\ndata: [{"type": "update", "data": []}]\n\n'
+                await asyncio.Event().wait()
+
+        headers = {"content-type": "text/event-stream"}
+        respx.get("https://10.0.0.2/eventstream/clip/v2").mock(
+            return_value=Response(200, headers=headers, stream=OpenStream()))
+        respx.get("https://10.0.0.7/eventstream/clip/v2").mock(
+            return_value=Response(
+                200,
+                headers=headers,
+                text='id: 2:0\ndata: [{"type": "add", "data": []}]\n\n'))
+        watcher = BridgeWatcher()
+        manager = BaseResourceManager(
+            AuthenticatedHueConnection("10.0.0.2", "u"))
+        watcher.attach("0017884a2b3c", manager)
+
+        events = manager.iter_events(reconnect=True)
+        assert (await anext(events))["type"] == "update"
+        next_change = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0.01)
+        assert not next_change.done()
+
+        watcher.service_changed(
+            FakeServiceInfo("hue", "10.0.0.7", "001788FFFE4A2B3C"))
+
+        assert (await asyncio.wait_for(next_change, 1))["type"] == "resync"
+        assert (await anext(events))["type"] == "add"
+        await events.aclose()
+
+
+BRIDGE_DESCRIPTION = """<?xml version="1.0" encoding="UTF-8" ?>
+<root xmlns="urn:schemas-upnp-org:device-1-0">
+<specVersion><major>1</major><minor>0</minor></specVersion>
+<URLBase>http://10.0.0.2:80/</URLBase>
+<device>
+<deviceType>urn:schemas-upnp-org:device:Basic:1</deviceType>
+<friendlyName>Hue Bridge (10.0.0.2)</friendlyName>
+<manufacturer>Signify</manufacturer>
+<manufacturerURL>http://www.philips-hue.com</manufacturerURL>
+<modelDescription>Philips hue Personal Wireless Lighting</modelDescription>
+<modelName>Philips hue bridge 2015</modelName>
+<modelNumber>BSB002</modelNumber>
+<serialNumber>0017884A2B3C</serialNumber>
+<UDN>uuid:2f402f80-da50-11e1-9b23-0017884a2b3c</UDN>
+<iconList><icon><mimetype>image/png</mimetype><url>hue_logo_0.png</url></icon>
+</iconList>
+</device>
+</root>
+"""
+
+
+class TestBridgeDescription(object):
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_parsed_once(self):
+        route = respx.get("http://a/description.xml").mock(
+            return_value=Response(200, text=BRIDGE_DESCRIPTION))
+        connection_info = UnauthenticatedHueRawConnectionInfo("a")
+
+        async with httpx.AsyncClient() as client:
+            assert await connection_info.validate(client=client)
+
+        assert route.call_count == 1
+        assert connection_info.bridge_id == "0017884a2b3c"
+        description = connection_info.description
+        assert description.model_number == "BSB002"
+        assert description.model_name == "Philips hue bridge 2015"
+        assert description.supports_clip_v2
+        assert description.supports_entertainment
+        assert not BridgeDescription(model_number="BSB001").supports_clip_v2
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_not_a_bridge(self):
+        respx.get("http://a/description.xml").mock(
+            return_value=Response(200, text="<root><device/></root>"))
+        respx.get("http://b/description.xml").mock(
+            return_value=Response(200, text="Philips, but not XML"))
+
+        for host in ("a", "b"):
+            connection_info = UnauthenticatedHueRawConnectionInfo(host)
+            assert not await connection_info.validate()
+            assert connection_info.description is None
@@ -0,0 +1,102 @@
+import asyncio
+import struct
+
+import pytest
+import respx
+from httpx import Response
+
+from pyhuelights.core import LightsManager
+from pyhuelights.entertainment import encode_frame_v1, encode_frame_v2
+from pyhuelights.entertainment import EntertainmentStreamer, UDPTransport
+from pyhuelights.entertainment import COLOR_SPACE_XY, streamable_lights
+from pyhuelights.registration import AuthenticatedHueConnection
+
+from utils import make_light
+
+ENTERTAINMENT_ID = "1a8d99cc-967b-44f2-9202-43f976c0fa6b"
+
+
+class TestEncoding:
+
+    def test_v1(self):
+        frame = encode_frame_v1([(1, (1.0, 0.0, 0.5)), (12, (0, 0, 0))],
+                                sequence=257)
+
+        assert frame[:16] == (b"HueStream\x01\x00\x01\x00\x00\x00\x00")
+        assert len(frame) == 16 + 2 * 9
+        assert struct.unpack(">BHHHH", frame[16:25]) == (0, 1, 65535, 0,
+                                                         32767)
+        assert struct.unpack(">BHHHH", frame[25:]) == (0, 12, 0, 0, 0)
+
+    def test_v1_too_many_lights(self):
+        with pytest.raises(ValueError):
+            encode_frame_v1([(x, (0, 0, 0)) for x in range(11)])
+
+    def test_v2(self):
+        frame = encode_frame_v2(ENTERTAINMENT_ID, [(3, (0.5, 0.4, 1.0))],
+                                color_space=COLOR_SPACE_XY)
+
+        assert frame[:16] == b"HueStream\x02\x00\x00\x00\x00\x01\x00"
+        assert frame[16:52] == ENTERTAINMENT_ID.encode("ascii")
+        assert struct.unpack(">BHHH", frame[52:]) == (3, 32767, 26214, 65535)
+
+    def test_v2_bad_id(self):
+        with pytest.raises(ValueError):
+            encode_frame_v2("abc", [])
+
+
+class TestEntertainmentStreamer:
+
+    def test_from_lights(self):
+        light = make_light("1")
+        assert streamable_lights([light]) == []
+
+        with pytest.raises(ValueError):
+            EntertainmentStreamer.from_lights(UDPTransport("host"), [light])
+
+    @pytest.mark.asyncio
+    async def test_streams_to_udp_receiver(self):
+        received = asyncio.Queue()
+
+        class Receiver(asyncio.DatagramProtocol):
+
+            def datagram_received(self, data, addr):
+                received.put_nowait(data)
+
+        loop = asyncio.get_running_loop()
+        server, _ = await loop.create_datagram_endpoint(
+            Receiver, local_addr=("127.0.0.1", 0))
+        port = server.get_extra_info("sockname")[1]
+
+        streamer = EntertainmentStreamer(UDPTransport("127.0.0.1", port),
+                                         [1, 2],
+                                         rate=50)
+        streamer.set_color(2, (1.0, 1.0, 1.0))
+        await streamer.start()
+        try:
+            frames = [
+                await asyncio.wait_for(received.get(), 1) for _ in range(3)
+            ]
+        finally:
+            await streamer.stop()
+            server.close()
+
+        assert [x[11] for x in frames] == [0, 1, 2]
+        assert frames[0][25:] == struct.pack(">BHHHH", 0, 2, 65535, 65535,
+                                             65535)
+        with pytest.raises(KeyError):
+            streamer.set_color(3, (0, 0, 0))
+
+
+class TestSetStreaming:
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_set_streaming(self):
+        route = respx.put("http://host/api/user/groups/5").mock(
+            return_value=Response(200, json=[]))
+
+        manager = LightsManager(AuthenticatedHueConnection("host", "user"))
+        await manager.set_streaming("5", True)
+
+        assert route.calls.last.request.content == b'{"stream":{"active":true}}'
@@ -0,0 +1,293 @@
+from copy import deepcopy
+
+import pytest
+import respx
+from httpx import Response
+
+from pyhuelights.mirror import BridgeStateMirror
+from pyhuelights.core import LightsManager
+from pyhuelights.network import BaseResourceManager
+from pyhuelights.registration import AuthenticatedHueConnection
+
+LIGHT_JSON = {
+    "state": {
+        "on": False,
+        "colormode": "ct",
+        "ct": 250,
+        "reachable": True
+    },
+    "capabilities": {
+        "control": {}
+    },
+    "name": "Light",
+    "type": "Color temperature light",
+    "modelid": "LTW001",
+    "swversion": "1.0",
+    "uniqueid": "uid"
+}
+
+
+def light_json(light_id):
+    obj = deepcopy(LIGHT_JSON)
+    obj["name"] = "Light " + light_id
+    obj["uniqueid"] = "uid-" + light_id
+    return obj
+
+
+GROUPS_JSON = {
+    "1": {
+        "name": "Living",
+        "lights": ["1", "2"],
+        "type": "Room",
+        "class": "Living room",
+        "action": {
+            "on": False,
+            "colormode": "ct"
+        }
+    },
+    "2": {
+        "name": "Lamps",
+        "lights": ["2"],
+        "type": "LightGroup",
+        "action": {
+            "on": False,
+            "colormode": "ct"
+        }
+    }
+}
+
+
+class TestBridgeStateMirror:
+
+    async def get_mirror(self):
+        respx.get("http://host/api/user/lights").mock(
+            return_value=Response(200,
+                                  json={
+                                      "1": light_json("1"),
+                                      "2": light_json("2")
+                                  }))
+        respx.get("http://host/api/user/groups").mock(
+            return_value=Response(200, json=GROUPS_JSON))
+
+        conn = AuthenticatedHueConnection("host", "user")
+        mirror = BridgeStateMirror(LightsManager(conn))
+        await mirror.load()
+        return mirror
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_lookups(self):
+        mirror = await self.get_mirror()
+
+        light1 = mirror.light("1")
+        assert light1._model.id == "1"
+        assert mirror.light("3") is None
+        assert mirror.light_by_unique_id("uid-2") is mirror.light("2")
+        assert mirror.light_by_name("Light 1") is light1
+
+        assert mirror.group_by_name("Living") is mirror.group("1")
+        assert mirror.groups_of_light("2") == [
+            mirror.group("1"), mirror.group("2")
+        ]
+        assert mirror.lights_in_group("2") == [mirror.light("2")]
+        assert mirror.groups_by_class("Living room") == [mirror.group("1")]
+        assert mirror.rooms() == [mirror.group("1")]
+        assert mirror.room_of_light("2") is mirror.group("1")
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_events_update_mirror(self, monkeypatch):
+        mirror = await self.get_mirror()
+        respx.get("http://host/api/user/lights/3").mock(
+            return_value=Response(200, json=light_json("3")))
+
+        async def iter_events(self, reconnect=False):
+            yield {
+                "type": "update",
+                "data": [{
+                    "id_v1": "/lights/1",
+                    "type": "light",
+                    "on": {
+                        "on": True
+                    }
+                }]
+            }
+            yield {
+                "type": "add",
+                "data": [{
+                    "id_v1": "/lights/3",
+                    "type": "light"
+                }]
+            }
+
+        monkeypatch.setattr(BaseResourceManager, "iter_events", iter_events)
+
+        await mirror.run()
+
+        assert mirror.light("1").on is True
+        assert mirror.light_by_unique_id("uid-3") is mirror.light("3")
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_group_events_update_mirror(self, monkeypatch):
+        mirror = await self.get_mirror()
+        zone = {
+            "name": "Desk",
+            "lights": ["1"],
+            "type": "Zone",
+            "action": {
+                "on": False,
+                "colormode": "ct"
+            }
+        }
+        respx.get("http://host/api/user/groups/3").mock(
+            return_value=Response(200, json=zone))
+        living = deepcopy(GROUPS_JSON["1"])
+        living["lights"] = ["1"]
+        respx.get("http://host/api/user/groups/1").mock(
+            return_value=Response(200, json=living))
+
+        async def iter_events(self, reconnect=False):
+            # Not loaded by get_all_groups, so ignored.
+            yield {
+                "type": "update",
+                "data": [{
+                    "id_v1": "/groups/0",
+                    "type": "grouped_light",
+                    "on": {
+                        "on": True
+                    }
+                }]
+            }
+            yield {
+                "type": "update",
+                "data": [{
+                    "id_v1": "/groups/2",
+                    "type": "grouped_light",
+                    "on": {
+                        "on": True
+                    }
+                }]
+            }
+            yield {
+                "type": "add",
+                "data": [{
+                    "id_v1": "/groups/3",
+                    "type": "zone"
+                }]
+            }
+            yield {
+                "type": "update",
+                "data": [{
+                    "id_v1": "/groups/1",
+                    "type": "room",
+                    "children": []
+                }]
+            }
+            yield {"type": "delete", "data": [{"id_v1": "/groups/2"}]}
+
+        monkeypatch.setattr(BaseResourceManager, "iter_events", iter_events)
+        lamps = mirror.group("2")
+
+        changed = [x async for x in mirror.iter_events()]
+
+        assert lamps.state.on is True
+        assert [x.id for x in changed] == ["2", "3", "1"]
+        assert mirror.group("2") is None
+        assert mirror.group_by_name("Lamps") is None
+        assert mirror.group_by_name("Desk") is mirror.group("3")
+        assert mirror.groups_of_light("2") == []
+        assert mirror.groups_of_light("1") == [
+            mirror.group("1"), mirror.group("3")
+        ]
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_resync_reindexes(self, monkeypatch):
+        mirror = await self.get_mirror()
+        renamed = light_json("1")
+        renamed["name"] = "Renamed"
+        respx.get("http://host/api/user/lights").mock(
+            return_value=Response(200,
+                                  json={
+                                      "1": renamed,
+                                      "2": light_json("2")
+                                  }))
+
+        async def iter_events(self, reconnect=False):
+            self.event_stats.resyncs += 1
+            yield {"type": "resync", "data": []}
+
+        monkeypatch.setattr(BaseResourceManager, "iter_events", iter_events)
+
+        await mirror.run()
+
+        assert mirror.light_by_name("Renamed") is mirror.light("1")
+        assert mirror.light_by_name("Light 1") is None
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_rename_event_reindexes(self, monkeypatch):
+        mirror = await self.get_mirror()
+
+        async def iter_events(self, reconnect=False):
+            yield {
+                "type": "update",
+                "data": [{
+                    "id_v1": "/lights/2",
+                    "type": "light",
+                    "metadata": {
+                        "name": "Porch"
+                    }
+                }]
+            }
+
+        monkeypatch.setattr(BaseResourceManager, "iter_events", iter_events)
+
+        await mirror.run()
+
+        assert mirror.light_by_name("Porch") is mirror.light("2")
+        assert mirror.light_by_name("Light 2") is None
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_duplicate_names_reindex_once(self, monkeypatch):
+        mirror = await self.get_mirror()
+
+        async def iter_events(self, reconnect=False):
+            yield {
+                "type": "update",
+                "data": [{
+                    "id_v1": "/lights/2",
+                    "type": "light",
+                    "metadata": {
+                        "name": "Light 1"
+                    }
+                }]
+            }
+            for light_id in ("1", "2", "1", "2"):
+                yield {
+                    "type": "update",
+                    "data": [{
+                        "id_v1": "/lights/" + light_id,
+                        "type": "light",
+                        "on": {
+                            "on": True
+                        }
+                    }]
+                }
+
+        monkeypatch.setattr(BaseResourceManager, "iter_events", iter_events)
+        reindexed = []
+
+        def reindex():
+            reindexed.append(True)
+            BridgeStateMirror.reindex(mirror)
+
+        monkeypatch.setattr(mirror, "reindex", reindex)
+
+        await mirror.run()
+
+        # Only the rename changes what the lights are indexed by.
+        assert len(reindexed) == 1
+        assert mirror.light("1")._model.state.on is True
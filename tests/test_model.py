@@ -2,11 +2,13 @@ from copy import deepcopy
 import pytest
 
 from pyhuelights.model import EMPTY, update_from_object, Light as LightRaw
+from pyhuelights.model import HueResource, Field
 from pyhuelights.core import Light, Temperature
 from pyhuelights.network import construct_body
 from pyhuelights.animations import SetLightStateEffect
 
-from utils import CustomResourceTestBase, SubResource, SubSubResource
+from utils import CustomResourceTestBase, CustomResource, SubResource
+from utils import SubSubResource
 
 
 class TestUpdateFromObject(CustomResourceTestBase):
@@ -217,3 +219,74 @@ class TestLightRaw:
                 'ct': 153
             }
         }
+
+
+class TestCompactStorage(CustomResourceTestBase):
+
+    def test_models_have_no_instance_dict(self):
+        light = LightRaw()
+        update_from_object(light, "id", LIGHT_JSON)
+
+        assert not hasattr(light, "__dict__")
+        assert not hasattr(light.state, "__dict__")
+        assert not hasattr(light.capabilities, "__dict__")
+
+    def test_dirty_mask(self):
+        resource = self.get_resource(self.obj)
+
+        assert resource.dirty_mask == 0
+
+        resource.field2 = "world"
+        assert resource.is_dirty("field2")
+        assert not resource.is_dirty("field3")
+
+        resource.reset()
+        assert resource.dirty_mask == 0
+        assert resource.field2 == "hello"
+
+    def test_shared_field(self):
+        name = Field(obj_prop_name="name")
+
+        class First(HueResource):
+            FIELDS = [Field(obj_prop_name="id", is_key=True), name]
+
+        class Second(HueResource):
+            FIELDS = [name]
+
+        first, second = First(), Second()
+        update_from_object(first, "1", {"name": "a"})
+        update_from_object(second, None, {"name": "b"})
+        first.name = "c"
+
+        assert (first.name, second.name) == ("c", "b")
+        assert construct_body(first) == {"name": "c"}
+        first.reset()
+        assert first.name == "a"
+
+
+class TestLazyParse(CustomResourceTestBase):
+
+    def test_nested_parsed_on_access(self):
+        resource = CustomResource()
+        update_from_object(resource, "id", self.obj, lazy=True)
+
+        assert resource.field2 == "hello"
+        assert resource.values[3] is self.obj["field3"]
+
+        assert resource.field3.sub2.test == 1
+        assert isinstance(resource.values[3], SubResource)
+        assert resource.field3 is resource.field3
+
+    def test_untouched_nested_resets_and_commits(self):
+        resource = CustomResource()
+        update_from_object(resource, "id", self.obj, lazy=True)
+
+        resource.field2 = "world"
+        resource.commit()
+        resource.reset()
+
+        assert resource.values[3] is self.obj["field3"]
+        assert construct_body(resource) == {}
+
+        resource.field3.sub2.test = 5
+        assert construct_body(resource) == {"field3": {"sub2": {"test": 5}}}
@@ -1,11 +1,16 @@
 import json
+import time
+import asyncio
+
 import pytest
 import respx
+import httpx
 from httpx import Response
 
 from pyhuelights.registration import AuthenticatedHueConnection
 from pyhuelights.exceptions import RequestFailed
 from pyhuelights.network import construct_body, dict_parser
+from pyhuelights.network import CommandScheduler, TokenBucket
 
 from utils import CustomResourceTestBase, CustomResource
 from utils import CustomResourceManager
@@ -36,6 +41,25 @@ class TestConstructBody(CustomResourceTestBase):
     def test_construct_body_none(self):
         assert construct_body(None) is None
 
+    def test_changed_only(self):
+        resource = self.get_resource(self.obj)
+
+        resource.field2 = "hello"
+        resource.field3.sub2.test = 5
+        resource.req = 4
+
+        assert construct_body(resource, changed_only=True) == {
+            "field3": {
+                "sub2": {
+                    "test": 5
+                }
+            },
+            "request": 4
+        }
+
+        resource.field3.sub2.test = 1
+        assert construct_body(resource, changed_only=True) == {}
+
 
 class TestBaseResourceManager(CustomResourceTestBase):
 
@@ -101,3 +125,331 @@ class TestBaseResourceManager(CustomResourceTestBase):
                 }
             }
         }
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_update_commits_acknowledged_fields(self):
+        route = respx.put("http://host/api/user/parent/id").mock(
+            return_value=Response(200, json=[
+                {"success": {"/parent/id/f2": "world"}},
+                {"error": {"type": 201, "address": "/parent/id/field3/sub2/test",
+                           "description": "not modifiable"}},
+            ]))
+        rm = CustomResourceManager(AuthenticatedHueConnection("host", "user"))
+        res = self.get_resource(self.obj)
+
+        res.field2 = "world"
+        res.field3.sub2.test = 5
+        res.req = "x"
+        await rm.put(res)
+
+        assert not res.is_dirty("field2")
+        assert res.orig_values[res.field_index["field2"]] == "world"
+        # Rejected: back to the bridge's value.
+        assert res.field3.sub2.test == 1
+        assert not res.is_dirty("field3")
+        assert not res.is_dirty("req")
+
+        # Fields the response does not mention stay pending.
+        route.mock(return_value=Response(200, json=[]))
+        res.field2 = "again"
+        await rm.put(res)
+        assert res.is_dirty("field2")
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_unchanged_update_suppressed(self):
+        update_route = respx.put("http://host/api/user/parent/id").mock(
+            return_value=Response(
+                200, json=[{"success": {"/parent/id/f2": "world"}}]))
+        rm = CustomResourceManager(AuthenticatedHueConnection("host", "user"),
+                                   skip_unchanged=True)
+        res = self.get_resource(self.obj)
+
+        res.field2 = "world"
+        await rm.put(res)
+        res.field2 = "world"
+        assert await rm.put(res) == []
+
+        assert update_route.call_count == 1
+        assert rm.suppressed_writes == 1
+        assert not res.is_dirty("field2")
+
+        rm.skip_unchanged = False
+        res.field2 = "world"
+        await rm.put(res)
+        assert update_route.call_count == 2
+        assert json.loads(update_route.calls.last.request.content) == {
+            "f2": "world"
+        }
+
+        # Unchanged fields left out of a sent body are committed too.
+        rm.skip_unchanged = True
+        update_route.mock(return_value=Response(
+            200, json=[{"success": {"/parent/id/field3/sub2/test": 5}}]))
+        res.field2 = "world"
+        res.field3.sub2.test = 5
+        await rm.put(res)
+        assert json.loads(update_route.calls.last.request.content) == {
+            "field3": {"sub2": {"test": 5}}
+        }
+        assert res.dirty_mask == 0
+
+
+class TestTokenBucket:
+
+    @pytest.mark.asyncio
+    async def test_throttles_after_burst(self):
+        bucket = TokenBucket(rate=20, capacity=2)
+
+        started = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+
+        # 2 from the burst, 2 more at 20/sec.
+        assert time.monotonic() - started >= 0.09
+
+
+class TestCommandScheduler(CustomResourceTestBase):
+
+    def test_bucket_key(self):
+        scheduler = CommandScheduler()
+
+        assert scheduler.bucket_key("/lights/1/state") == "lights"
+        assert scheduler.bucket_key("/groups/1/action") == "groups"
+        assert scheduler.bucket_key("/config") is None
+
+    @pytest.mark.asyncio
+    async def test_metrics(self):
+        scheduler = CommandScheduler(lights_rate=50, groups_rate=1)
+        scheduler.buckets["lights"].tokens = 0
+        sent = []
+
+        async def send(body):
+            sent.append(body)
+
+        await asyncio.gather(*(scheduler.schedule("/lights/1/state", {}, send)
+                               for _ in range(3)))
+
+        metrics = scheduler.metrics["lights"]
+        assert len(sent) == 3
+        assert metrics.sent == 3
+        assert metrics.queue_depth == 0
+        assert metrics.max_queue_depth == 3
+        assert metrics.max_wait_time > 0
+        assert metrics.average_wait_time > 0
+        assert scheduler.metrics["groups"].sent == 0
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_update_through_scheduler(self):
+        respx.get("http://host/api/user/res").mock(
+            return_value=Response(200, json={"1": self.DEFAULT_OBJ}))
+        update_route = respx.put("http://host/api/user/parent/1").mock(
+            return_value=Response(200, json={}))
+
+        scheduler = CommandScheduler()
+        conn = AuthenticatedHueConnection("host", "user")
+        rm = CustomResourceManager(conn, scheduler=scheduler)
+
+        res = (await rm.get())['1']
+        res.field2 = "world"
+        await rm.put(res)
+
+        assert update_route.called
+        # "/parent/..." is not throttled.
+        assert all(x.sent == 0 for x in scheduler.metrics.values())
+
+    @pytest.mark.asyncio
+    async def test_coalesce(self):
+        scheduler = CommandScheduler(lights_rate=50, coalesce=True)
+        scheduler.buckets["lights"].tokens = 0
+        sent = []
+
+        async def send(body):
+            sent.append(body)
+            return len(sent)
+
+        results = await asyncio.gather(
+            scheduler.schedule("/lights/1/state", {"on": True, "bri": 1}, send),
+            scheduler.schedule("/lights/1/state", {"bri": 2}, send),
+            scheduler.schedule("/lights/2/state", {"on": False}, send),
+            scheduler.schedule("/lights/1/state", {"xy": [0.1, 0.2]}, send))
+
+        assert sent == [{"on": True, "bri": 2, "xy": [0.1, 0.2]}, {"on": False}]
+        assert results == [1, 1, 2, 1]
+        assert scheduler.metrics["lights"].sent == 2
+        assert scheduler.metrics["lights"].coalesced == 2
+        assert not scheduler.pending
+
+    @pytest.mark.asyncio
+    async def test_coalesce_error_propagates(self):
+        scheduler = CommandScheduler(lights_rate=50, coalesce=True)
+        scheduler.buckets["lights"].tokens = 0
+
+        async def send(body):
+            raise RequestFailed(500, "")
+
+        results = await asyncio.gather(
+            scheduler.schedule("/lights/1/state", {"on": True}, send),
+            scheduler.schedule("/lights/1/state", {"on": False}, send),
+            return_exceptions=True)
+
+        assert all(isinstance(x, RequestFailed) for x in results)
+
+    @pytest.mark.asyncio
+    async def test_coalesce_survives_cancelled_leader(self):
+        scheduler = CommandScheduler(lights_rate=20, coalesce=True)
+        scheduler.buckets["lights"].tokens = 0
+        sent = []
+
+        async def send(body):
+            sent.append(body)
+            return len(sent)
+
+        leader = asyncio.create_task(
+            scheduler.schedule("/lights/1/state", {"on": True}, send))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(
+            scheduler.schedule("/lights/1/state", {"bri": 5}, send))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        assert await follower == 1
+        assert leader.cancelled()
+        assert sent == [{"on": True, "bri": 5}]
+        assert not scheduler.pending
+
+    @pytest.mark.asyncio
+    async def test_coalesce_all_cancelled(self):
+        scheduler = CommandScheduler(lights_rate=20, coalesce=True)
+        scheduler.buckets["lights"].tokens = 0
+        sent = []
+
+        async def send(body):
+            sent.append(body)
+
+        task = asyncio.create_task(
+            scheduler.schedule("/lights/1/state", {"on": True}, send))
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.sleep(0.1)
+
+        assert task.cancelled()
+        assert sent == []
+        assert not scheduler.pending
+
+
+class TestClientLifecycle(CustomResourceTestBase):
+
+    @pytest.mark.asyncio
+    async def test_context_manager_closes_client(self):
+        conn = AuthenticatedHueConnection("host", "user")
+        async with CustomResourceManager(conn) as rm:
+            client = await rm.get_client()
+            assert await rm.get_client() is client
+
+        assert client.is_closed
+        assert rm._client is None
+
+    @pytest.mark.asyncio
+    async def test_external_client_not_closed(self):
+        client = httpx.AsyncClient()
+        conn = AuthenticatedHueConnection("host", "user")
+        async with CustomResourceManager(conn, client=client):
+            pass
+
+        assert not client.is_closed
+        await client.aclose()
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_events_use_shared_client(self):
+        respx.get("https://host/eventstream/clip/v2").mock(
+            return_value=Response(
+                200,
+                headers={"content-type": "text/event-stream"},
+                text='data: [{"type": "update", "data": []}]\n\n'))
+
+        conn = AuthenticatedHueConnection("host", "user")
+        async with CustomResourceManager(conn) as rm:
+            client = await rm.get_client()
+            changes = [x async for x in rm.iter_events()]
+            assert await rm.get_client() is client
+
+        assert changes == [{"type": "update", "data": []}]
+
+
+def sse_response(text):
+    return Response(200,
+                    headers={"content-type": "text/event-stream"},
+                    text=text)
+
+
+class TestEventStreamReconnect(CustomResourceTestBase):
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_reconnect_and_resume(self):
+        route = respx.get("https://host/eventstream/clip/v2")
+        route.side_effect = [
+            httpx.ConnectError("down"),
+            sse_response('id: 1:0\ndata: [{"type": "update", "data": []}]\n\n'),
+            sse_response('id: 2:0\ndata: [{"type": "add", "data": []}]\n\n'),
+        ]
+
+        conn = AuthenticatedHueConnection("host", "user")
+        rm = CustomResourceManager(conn)
+        rm.RECONNECT_BASE_DELAY = 0.001
+
+        changes = []
+        async for change in rm.iter_events(reconnect=True):
+            changes.append(change["type"])
+            if len(changes) == 3:
+                break
+
+        assert changes == ["update", "resync", "add"]
+        assert "Last-Event-ID" not in route.calls[1].request.headers
+        assert route.calls[2].request.headers["Last-Event-ID"] == "1:0"
+        assert rm.event_stats.reconnects == 2
+        assert rm.event_stats.resyncs == 1
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_reconnect_follows_host_change(self):
+        conn = AuthenticatedHueConnection("host", "user")
+
+        def moved(request):
+            conn.host = "new-host"
+            raise httpx.ConnectError("moved")
+
+        respx.get("https://host/eventstream/clip/v2").mock(side_effect=moved)
+        respx.get("https://new-host/eventstream/clip/v2").mock(
+            return_value=sse_response(
+                'id: 1:0\ndata: [{"type": "update", "data": []}]\n\n'))
+        rm = CustomResourceManager(conn)
+        rm.RECONNECT_BASE_DELAY = 0.001
+
+        async for change in rm.iter_events(reconnect=True):
+            assert change["type"] == "update"
+            break
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_no_reconnect_on_auth_failure(self):
+        respx.get("https://host/eventstream/clip/v2").mock(
+            return_value=Response(403))
+
+        conn = AuthenticatedHueConnection("host", "user")
+        rm = CustomResourceManager(conn)
+
+        with pytest.raises(RequestFailed):
+            async for _ in rm.iter_events(reconnect=True):
+                pass
+
+    def test_reconnect_delay(self):
+        rm = CustomResourceManager(AuthenticatedHueConnection("host", "user"))
+
+        assert all(0 <= rm.reconnect_delay(x) <= rm.RECONNECT_BASE_DELAY * 2**x
+                   for x in range(5))
+        assert rm.reconnect_delay(100) <= rm.RECONNECT_MAX_DELAY
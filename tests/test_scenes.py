@@ -0,0 +1,174 @@
+import json
+
+import pytest
+import respx
+from httpx import Response
+
+from pyhuelights.core import LightsManager, Temperature
+from pyhuelights.animations import SetLightStateEffect
+from pyhuelights.exceptions import RequestFailed
+from pyhuelights.registration import AuthenticatedHueConnection
+from pyhuelights.scenes import SceneManager, scene_light_state
+
+from utils import make_light
+
+
+def get_scene_manager():
+    conn = AuthenticatedHueConnection("host", "user")
+    return SceneManager(LightsManager(conn))
+
+
+class TestSceneManager:
+
+    @pytest.mark.asyncio
+    async def test_scene_light_state(self):
+        light = make_light("1")
+        light._model.state.effect = "colorloop"
+
+        state = await scene_light_state(
+            light, SetLightStateEffect(on=True, color=Temperature(2000)))
+
+        assert state == {"on": True, "ct": 500}
+        # The caller's model, and its pending change, are left alone.
+        assert light._model.state.on is False
+        assert light._model.state.effect == "colorloop"
+        assert light._model.state.is_dirty("effect")
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_save_and_reuse(self):
+        create_route = respx.post("http://host/api/user/scenes").mock(
+            return_value=Response(200, json=[{
+                "success": {
+                    "id": "abc"
+                }
+            }]))
+        recall_route = respx.put("http://host/api/user/groups/0/action").mock(
+            return_value=Response(200, json=[]))
+
+        scenes = get_scene_manager()
+        lights = [make_light("1"), make_light("2")]
+        look = {
+            lights[0]: SetLightStateEffect(on=True, color=Temperature(2000)),
+            lights[1]: SetLightStateEffect(on=False),
+        }
+
+        assert await scenes.apply(look) == "abc"
+        assert await scenes.apply(look) == "abc"
+
+        assert create_route.call_count == 1
+        body = json.loads(create_route.calls.last.request.content)
+        assert body["lights"] == ["1", "2"]
+        assert body["lightstates"] == {
+            "1": {
+                "on": True,
+                "ct": 500
+            },
+            "2": {
+                "on": False
+            }
+        }
+        assert body["name"].startswith(SceneManager.NAME_PREFIX)
+        assert len(body["name"]) <= 32
+
+        assert recall_route.call_count == 2
+        assert json.loads(recall_route.calls.last.request.content) == {
+            "scene": "abc"
+        }
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_update(self):
+        route = respx.put("http://host/api/user/scenes/abc").mock(
+            return_value=Response(200, json=[]))
+
+        scenes = get_scene_manager()
+        light = make_light("1")
+        look = {light: SetLightStateEffect(on=True)}
+
+        assert await scenes.save(look, scene_id="abc") == "abc"
+        assert route.called
+        assert list(scenes.scene_ids.values()) == ["abc"]
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_create_failure(self):
+        respx.post("http://host/api/user/scenes").mock(
+            return_value=Response(200, json=[{
+                "error": {}
+            }]))
+
+        scenes = get_scene_manager()
+        with pytest.raises(RequestFailed):
+            await scenes.save({make_light("1"): SetLightStateEffect(on=True)})
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_load_cache(self):
+        respx.get("http://host/api/user/scenes").mock(
+            return_value=Response(200,
+                                  json={
+                                      "abc": {
+                                          "name": "pyhuelights-0123456789abcdef",
+                                          "type": "LightScene",
+                                          "lights": ["1"]
+                                      },
+                                      "def": {
+                                          "name": "Relax",
+                                          "lights": ["1"]
+                                      }
+                                  }))
+
+        scenes = get_scene_manager()
+        await scenes.load_cache()
+
+        assert scenes.scene_ids == {"0123456789abcdef": "abc"}
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_recycled_scene_recreated(self):
+        create_route = respx.post("http://host/api/user/scenes").mock(
+            return_value=Response(200, json=[{
+                "success": {
+                    "id": "new"
+                }
+            }]))
+        recall_route = respx.put("http://host/api/user/groups/0/action")
+        recall_route.side_effect = [
+            Response(200,
+                     json=[{
+                         "error": {
+                             "type": 7,
+                             "description": "invalid value, old"
+                         }
+                     }]),
+            Response(200, json=[{
+                "success": {
+                    "/groups/0/action/scene": "new"
+                }
+            }]),
+        ]
+
+        scenes = get_scene_manager()
+        look = {make_light("1"): SetLightStateEffect(on=True)}
+        digest = scenes.content_hash(await scenes.build_light_states(look))
+        scenes.scene_ids[digest] = "old"
+
+        assert await scenes.apply(look) == "new"
+
+        assert create_route.call_count == 1
+        assert scenes.scene_ids == {digest: "new"}
+        assert json.loads(recall_route.calls.last.request.content) == {
+            "scene": "new"
+        }
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_recall_error(self):
+        respx.put("http://host/api/user/groups/0/action").mock(
+            return_value=Response(200, json=[{
+                "error": {}
+            }]))
+
+        with pytest.raises(RequestFailed):
+            await get_scene_manager().recall("abc")
@@ -0,0 +1,237 @@
+import json
+import math
+from copy import deepcopy
+
+import pytest
+import respx
+from httpx import Response
+
+from pyhuelights.core import Light, LightsManager, RGB, Temperature
+from pyhuelights.colorutils import rgb_to_xy, temperature_to_xy
+from pyhuelights.model import Light as LightRaw, update_from_object
+from pyhuelights.registration import AuthenticatedHueConnection
+from pyhuelights.timeline import Keyframe, Timeline, TimelineEffect
+from pyhuelights.timeline import play_stream, plan_commands, sample_trajectory
+from pyhuelights.timeline import PlannedCommand, PlannedEffect
+
+from utils import LIGHT_JSON
+
+
+class TestTimeline:
+
+    def test_compile(self):
+        timeline = Timeline().add(
+            "1", Keyframe(0, color=RGB(255, 0, 0), brightness=0),
+            Keyframe(1, brightness=200),
+            Keyframe(2, color=Temperature(2700), on=False, easing="step"))
+
+        compiled = timeline.compile(rate=10)
+        track = compiled.tracks["1"]
+
+        assert compiled.frame_count == 21
+        assert len(track.x) == 21
+        assert track.x.itemsize == 4
+
+        red = rgb_to_xy(255, 0, 0)
+        assert track.frame(0)[:3] == (True, pytest.approx(red[0]),
+                                      pytest.approx(red[1]))
+        assert track.brightness[0] == 0
+        assert track.brightness[5] == 100
+        assert track.brightness[10] == 200
+        # Step easing holds the previous values until the keyframe.
+        assert track.frame(19)[:3] == (True, pytest.approx(red[0]),
+                                       pytest.approx(red[1]))
+        warm = temperature_to_xy(2700)
+        assert track.frame(20) == (False, pytest.approx(warm[0]),
+                                   pytest.approx(warm[1]), 200)
+
+    def test_easing(self):
+        timeline = Timeline().add("1", Keyframe(0, brightness=0),
+                                  Keyframe(1, brightness=200, easing="ease_in"))
+        track = timeline.compile(rate=4).tracks["1"]
+
+        assert list(track.brightness) == [0, 12, 50, 112, 200]
+
+    def test_unknown_easing(self):
+        with pytest.raises(ValueError):
+            Timeline().add("1", Keyframe(0, easing="bounce"))
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_run_effect(self):
+        route = respx.put("http://host/api/user/lights/1/state").mock(
+            return_value=Response(200, json=[]))
+        data = deepcopy(LIGHT_JSON)
+        data["state"].update({"xy": [0.3, 0.3], "bri": 10})
+        light_model = LightRaw()
+        update_from_object(light_model, "1", data)
+
+        compiled = Timeline().add(
+            "1", Keyframe(0, color=RGB(255, 0, 0), brightness=100),
+            Keyframe(0.1, brightness=100),
+            Keyframe(0.2, brightness=200)).compile(rate=20)
+        manager = LightsManager(AuthenticatedHueConnection("host", "user"))
+
+        await manager.run_effect(Light(light_model), TimelineEffect(compiled))
+
+        bodies = [json.loads(x.request.content) for x in route.calls]
+        # Frames 1 and 2 repeat frame 0 and are skipped.
+        assert len(bodies) == 3
+        assert set(bodies[0]) == {
+            "on", "xy", "colormode", "bri", "transitiontime"
+        }
+        assert bodies[1] == {"bri": 150, "transitiontime": 0}
+        assert bodies[2] == {"bri": 200, "transitiontime": 0}
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_run_effect_skips_unsupported_fields(self):
+        route = respx.put("http://host/api/user/lights/1/state").mock(
+            return_value=Response(200, json=[]))
+        # An on/off light: no xy and no bri in its state.
+        light_model = LightRaw()
+        update_from_object(light_model, "1", deepcopy(LIGHT_JSON))
+
+        compiled = Timeline().add(
+            "1", Keyframe(0, color=RGB(255, 0, 0), brightness=100),
+            Keyframe(0.1, brightness=200)).compile(rate=20)
+        manager = LightsManager(AuthenticatedHueConnection("host", "user"))
+
+        summary = await manager.run_effect(Light(light_model),
+                                           TimelineEffect(compiled))
+
+        assert len(summary.succeeded) == 1
+        assert [json.loads(x.request.content) for x in route.calls] == [{
+            "on": True,
+            "transitiontime": 0
+        }]
+
+    @pytest.mark.asyncio
+    async def test_play_stream(self):
+
+        class Streamer:
+
+            def __init__(self):
+                self.frames = []
+
+            def set_color(self, light_id, values):
+                self.frames.append((light_id, values))
+
+        compiled = Timeline().add("3", Keyframe(0, brightness=0),
+                                  Keyframe(0.1,
+                                           brightness=254)).compile(rate=20)
+        streamer = Streamer()
+
+        await play_stream(compiled, streamer)
+
+        assert [x[0] for x in streamer.frames] == [3, 3, 3]
+        assert [x[1][2] for x in streamer.frames] == [0.0, 127 / 254.0, 1.0]
+
+    @pytest.mark.asyncio
+    async def test_play_stream_keeps_last_frame(self):
+
+        class LateClock:
+            """ A clock that has fallen far behind on every tick. """
+
+            def ticker(self):
+                return self
+
+            frame = 0
+
+            async def tick(self):
+                return 100
+
+        class Streamer:
+
+            def __init__(self):
+                self.frames = []
+
+            def set_color(self, light_id, values):
+                self.frames.append(values[2])
+
+        compiled = Timeline().add("3", Keyframe(0, brightness=0),
+                                  Keyframe(0.1,
+                                           brightness=254)).compile(rate=20)
+        streamer = Streamer()
+
+        await play_stream(compiled, streamer, LateClock())
+
+        assert streamer.frames == [0.0, 1.0]
+
+class TestPlanner:
+
+    def test_linear_fade_is_one_command(self):
+        track = sample_trajectory(lambda t: (True, 0.3, 0.3, 25.4 * t),
+                                  duration=10,
+                                  rate=10)
+
+        commands = plan_commands(track, 10)
+
+        assert len(track.on) == 101
+        assert commands == [
+            PlannedCommand(0, True, (pytest.approx(0.3), pytest.approx(0.3)),
+                           0, 0),
+            PlannedCommand(0, True, (pytest.approx(0.3), pytest.approx(0.3)),
+                           254, 100),
+        ]
+
+    def test_curve_within_tolerance(self):
+        track = sample_trajectory(
+            lambda t: (True, 0.3 + 0.1 * math.sin(t), 0.3, 127 +
+                       127 * math.sin(t)),
+            duration=2 * math.pi,
+            rate=20)
+
+        commands = plan_commands(track, 20, xy_tolerance=0.005,
+                                 brightness_tolerance=3)
+
+        assert len(commands) * 5 < len(track.on)
+        # Replay the linear fades and compare against every sample.
+        for prev, cur in zip(commands[1:], commands[2:]):
+            assert cur.time == pytest.approx(prev.time +
+                                             prev.transition_time / 10.0)
+        for command in commands[1:]:
+            start = round(command.time * 20)
+            end = start + command.transition_time * 2
+            for k in range(start, end + 1):
+                f = (k - start) / (end - start)
+                x = track.x[start] + (command.xy[0] - track.x[start]) * f
+                assert abs(x - track.x[k]) <= 0.005 + 1e-6
+
+    def test_on_off_ends_segment(self):
+        track = sample_trajectory(lambda t: (t < 0.5, 0.3, 0.3, 100),
+                                  duration=1,
+                                  rate=10)
+
+        commands = plan_commands(track, 10)
+
+        assert [(x.time, x.on) for x in commands] == [(0, True), (0, True),
+                                                     (0.4, False),
+                                                     (0.5, False)]
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_planned_effect(self):
+        route = respx.put("http://host/api/user/lights/1/state").mock(
+            return_value=Response(200, json=[]))
+        data = deepcopy(LIGHT_JSON)
+        data["state"].update({"xy": [0.3, 0.3], "bri": 10, "on": True})
+        light_model = LightRaw()
+        update_from_object(light_model, "1", data)
+
+        compiled = Timeline().add("1", Keyframe(0, brightness=0),
+                                  Keyframe(0.2,
+                                           brightness=200)).compile(rate=50)
+        effect = PlannedEffect.from_timeline(compiled)
+        manager = LightsManager(AuthenticatedHueConnection("host", "user"))
+
+        await manager.run_effect(Light(light_model), effect)
+
+        bodies = [json.loads(x.request.content) for x in route.calls]
+        assert bodies == [{
+            "bri": 0,
+            "transitiontime": 0
+        }, {
+            "bri": 200,
+            "transitiontime": 2
+        }]
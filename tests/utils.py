@@ -1,7 +1,9 @@
 from copy import deepcopy
 from typing import Any
 
+from pyhuelights.core import Light
 from pyhuelights.model import HueResource, Field, update_from_object, contains
+from pyhuelights.model import Light as LightRaw
 from pyhuelights.network import BaseResourceManager, dict_parser
 
 
@@ -64,3 +66,28 @@ class CustomResourceTestBase(object):
         self.resource = CustomResource()
         update_from_object(self.resource, "id", obj)
         return self.resource
+
+
+LIGHT_JSON = {
+    "state": {
+        "on": False,
+        "colormode": "ct",
+        "ct": 250,
+        "effect": "none",
+        "reachable": True
+    },
+    "capabilities": {
+        "control": {}
+    },
+    "name": "Light",
+    "type": "Color temperature light",
+    "modelid": "LTW001",
+    "swversion": "1.0",
+    "uniqueid": "00:17:88:01:00:bc:c6:12-0b"
+}
+
+
+def make_light(light_id):
+    light_model = LightRaw()
+    update_from_object(light_model, light_id, LIGHT_JSON)
+    return Light(light_model)